@@ -7,7 +7,7 @@ from elsie import SlideDeck, TextStyle as T
 from elsie.boxtree.box import Box
 
 from config import sh, sw
-from utils import COLOR_ORANGE, next_two_slides, quotation
+from utils import COLOR_ORANGE, cached_chart, chart_figure, next_two_slides, quotation
 
 
 def timeline(slides: SlideDeck):
@@ -157,18 +157,14 @@ as deprecated.""",
     render_year(2023, year_2023)
 
 
+@cached_chart
 def render_plot(data):
     import seaborn as sns
-    import matplotlib.pyplot as plt
 
     data["date"] = pd.to_datetime(data["date"])
 
-    plt.clf()
-    with plt.xkcd():
-        px = 1 / plt.rcParams["figure.dpi"]
-        plt.figure(figsize=(1200 * px, 700 * px))
-
-        ax = sns.lineplot(data=data, x="date", y="count")
+    with chart_figure("growth", 1200, 700) as figure:
+        ax = sns.lineplot(data=data, x="date", y="count", ax=figure.subplots())
         ax.tick_params(labelsize=20)
         ax.set_xlabel("Year", fontsize=20)
         ax.set_ylabel("Count", fontsize=20)
@@ -176,7 +172,7 @@ def render_plot(data):
 
         buffer = io.BytesIO()
 
-        plt.savefig(buffer, format="png")
+        figure.savefig(buffer, format="png")
         buffer.seek(0)
     return buffer
 
@@ -6,7 +6,7 @@ from elsie import SlideDeck, Arrow, TextStyle as T
 from elsie.boxtree.box import Box
 
 from config import sh, sw
-from utils import quotation, code, QUOTATION_BG
+from utils import quotation, code, QUOTATION_BG, cached_chart, chart_figure
 
 
 def performance(slides: SlideDeck):
@@ -130,23 +130,27 @@ to optimize away over 700 CPU and 300GB of memory.
     def nodejs(slide: Box):
         slide.box(width=sw(1600)).image("images/rust-nodejs.png")
 
-    def render_plot(data):
+    @cached_chart
+    def render_plot_layers(series: List[pd.DataFrame], width: float,
+                           height: float) -> List[io.BytesIO]:
+        """
+        Renders the chart once and exports it as an opaque base layer (axes, labels, legend frame)
+        followed by one transparent layer for each series (its line and legend entry).
+        The first series is only used to reserve space in the legend and it is drawn in white.
+        """
         import seaborn as sns
         import matplotlib.pyplot as plt
 
+        data = pd.concat(series)
         seaborn_palette = sns.color_palette()
         palette = [seaborn_palette[0], seaborn_palette[3], seaborn_palette[1]]
-        palette = ["white"] + palette[:len(data["language"].unique()) - 1]
-
-        plt.clf()
-        params = {"legend.handlelength": 4, "legend.handleheight": 4}
-        plt.rcParams.update(params)
-        with plt.xkcd():
-            px = 1 / plt.rcParams["figure.dpi"]
-            plt.figure(figsize=(sw(1800) * px, sh(900) * px))
+        palette = ["white"] + palette[:len(series) - 1]
 
+        with chart_figure("time-to-performance", width, height, **{
+            "legend.handlelength": 4, "legend.handleheight": 4
+        }) as figure:
             ax = sns.lineplot(data, x="time", y="perf", hue="language", palette=palette,
-                                  linewidth=5)
+                              linewidth=5, ax=figure.subplots())
             ax.set(xticks=[], yticks=[])
             fontsize = 40
             ax.set_xlabel("Time", fontsize=fontsize)
@@ -154,14 +158,38 @@ to optimize away over 700 CPU and 300GB of memory.
             ax.set(ylim=[0, 15])
 
             sns.move_legend(ax, "upper left", bbox_to_anchor=(1, 1))
-            plt.setp(ax.get_legend().get_texts(), fontsize="32")
-            plt.setp(ax.get_legend().get_title(), fontsize="32")
-
-            buffer = io.BytesIO()
-            plt.tight_layout()
-            plt.savefig(buffer, format="png")
-            buffer.seek(0)
-        return buffer
+            legend = ax.get_legend()
+            plt.setp(legend.get_texts(), fontsize="32")
+            plt.setp(legend.get_title(), fontsize="32")
+            figure.tight_layout()
+
+            lines = ax.get_lines()[:len(series)]
+            legend_entries = list(zip(legend.get_texts(), legend.legend_handles))
+
+            def export(transparent: bool) -> io.BytesIO:
+                buffer = io.BytesIO()
+                figure.savefig(buffer, format="png", transparent=transparent)
+                buffer.seek(0)
+                return buffer
+
+            def show_series(index: int):
+                for (line_index, line) in enumerate(lines):
+                    line.set_visible(line_index == index)
+                for (entry_index, (text, handle)) in enumerate(legend_entries):
+                    text.set_visible(entry_index == index)
+                    handle.set_visible(entry_index == index)
+
+            show_series(0)
+            layers = [export(transparent=False)]
+
+            # Only the series line and its legend entry are drawn in the remaining layers
+            ax.set_axis_off()
+            legend.get_frame().set_visible(False)
+            legend.get_title().set_visible(False)
+            for index in range(1, len(series)):
+                show_series(index)
+                layers.append(export(transparent=True))
+        return layers
 
     @slides.slide()
     def time_to_performance(slide: Box):
@@ -178,14 +206,8 @@ to optimize away over 700 CPU and 300GB of memory.
         empty_data = python_data.copy()
         empty_data["language"] = " "
 
-        plot0 = render_plot(empty_data)
-        chart_box.box(width=sw(1600)).image(plot0, image_type="png")
-
-        plot1 = render_plot(pd.concat((empty_data, python_data)))
-        chart_box.overlay(show="next+").image(plot1, image_type="png")
-
-        plot2 = render_plot(pd.concat((empty_data, python_data, cpp_data)))
-        chart_box.overlay(show="next+").image(plot2, image_type="png")
-
-        plot3 = render_plot(pd.concat((empty_data, python_data, cpp_data, rust_data)))
-        chart_box.overlay(show="next+").image(plot3, image_type="png")
+        layers = render_plot_layers([empty_data, python_data, cpp_data, rust_data], sw(1800),
+                                    sh(900))
+        chart_box.box(width=sw(1600)).image(layers[0], image_type="png")
+        for layer in layers[1:]:
+            chart_box.overlay(show="next+").image(layer, image_type="png")
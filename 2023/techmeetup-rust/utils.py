@@ -1,8 +1,18 @@
+import contextlib
+import functools
+import hashlib
+import inspect
 import io
-from typing import Optional, Tuple, Union
+import json
+import os
+import shutil
+import tracemalloc
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple, Union
 
 import elsie
 from elsie import Arrow, Slides, TextStyle as T
+from elsie.boxtree import boxmixin
 from elsie.boxtree.box import Box
 from elsie.boxtree.boxitem import BoxItem
 from elsie.ext import unordered_list
@@ -79,6 +89,37 @@ def code(parent: Box, code: str, language="rust", width=None, code_style="code",
     return codebox
 
 
+# Shared by all decks, identical snippets in different talks use the same entry
+HIGHLIGHT_CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "talks-highlight"
+
+
+def cached_highlight_code(code: str, language: str) -> List[Tuple]:
+    """
+    Replacement of elsie's `highlight_code` that stores the Pygments tokens on disk, keyed by
+    the language, the code and the Pygments/elsie versions.
+    """
+    import pygments
+    from elsie.text.highlight import highlight_code
+    from elsie.version import VERSION
+
+    hasher = hashlib.sha1(f"{pygments.__version__}/{VERSION}/{language}".encode())
+    hasher.update(code.encode())
+    path = HIGHLIGHT_CACHE_DIR / f"{hasher.hexdigest()}.json"
+    if path.is_file():
+        return [tuple(token) for token in json.loads(path.read_text())]
+
+    tokens = highlight_code(code, language)
+    HIGHLIGHT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(tokens))
+    tmp_path.replace(path)
+    return tokens
+
+
+# `Box.code` tokenizes snippets through this name
+boxmixin.highlight_code = cached_highlight_code
+
+
 def with_bg(parent: Box, bg_color="#DDDDDD") -> Box:
     quote = parent.box()
     quote.rect(bg_color=bg_color)
@@ -228,3 +269,108 @@ def dimmed_list_item(parent: ListBuilder, text: str, show: int,
     wrapper = parent.item(show=f"{show}+")
     wrapper.box(show=f"{show + highlight_steps + 1}+").text(text, T(opacity=LOWER_OPACITY))
     wrapper.overlay(show=f"{show}-{(show + highlight_steps)}").text(text, T(**text_style))
+
+
+CHART_CACHE_DIR = Path("elsie-cache/charts")
+
+ChartOutput = Union[io.BytesIO, List[io.BytesIO]]
+
+
+def hash_chart_argument(hasher, value):
+    import pandas as pd
+
+    if isinstance(value, pd.DataFrame):
+        hasher.update(repr((list(value.columns), list(value.dtypes))).encode())
+        hasher.update(pd.util.hash_pandas_object(value).values.tobytes())
+    elif isinstance(value, (list, tuple)):
+        hasher.update(f"{type(value).__name__}{len(value)}".encode())
+        for item in value:
+            hash_chart_argument(hasher, item)
+    else:
+        hasher.update(repr(value).encode())
+
+
+def cached_chart(render_fn: Callable[..., ChartOutput]) -> Callable[..., ChartOutput]:
+    """
+    Stores the rendered chart (or a list of chart layers) on disk, keyed by the chart arguments
+    (DataFrames by their content), the source code of the render function and
+    the matplotlib/seaborn versions.
+    """
+
+    @functools.wraps(render_fn)
+    def wrapper(*args, **kwargs) -> ChartOutput:
+        import matplotlib
+        import seaborn
+
+        hasher = hashlib.sha1(f"{matplotlib.__version__}/{seaborn.__version__}".encode())
+        hasher.update(inspect.getsource(render_fn).encode())
+        for arg in args:
+            hash_chart_argument(hasher, arg)
+        for (name, arg) in sorted(kwargs.items()):
+            hasher.update(name.encode())
+            hash_chart_argument(hasher, arg)
+
+        key = hasher.hexdigest()
+        path = CHART_CACHE_DIR / f"{key}.png"
+        layer_dir = CHART_CACHE_DIR / key
+        if not path.is_file() and not layer_dir.is_dir():
+            CHART_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            output = render_fn(*args, **kwargs)
+            if isinstance(output, list):
+                tmp_dir = CHART_CACHE_DIR / f"{key}.tmp"
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                tmp_dir.mkdir()
+                for (index, buffer) in enumerate(output):
+                    (tmp_dir / f"{index}.png").write_bytes(buffer.getvalue())
+                tmp_dir.replace(layer_dir)
+            else:
+                tmp_path = path.with_suffix(".tmp")
+                tmp_path.write_bytes(output.getvalue())
+                tmp_path.replace(path)
+
+        if layer_dir.is_dir():
+            layers = sorted(layer_dir.iterdir(), key=lambda layer: int(layer.stem))
+            return [io.BytesIO(layer.read_bytes()) for layer in layers]
+        return io.BytesIO(path.read_bytes())
+
+    return wrapper
+
+
+CHART_FIGURE = None
+
+
+@contextlib.contextmanager
+def chart_figure(name: str, width: float, height: float, **rc_params):
+    """
+    Provides an empty xkcd-style figure of `width`x`height` pixels for a single chart.
+    All charts share one figure with an Agg canvas that is not registered with pyplot, so no
+    figures stay alive between charts. Prints the peak memory allocated while drawing the chart,
+    as traced by `tracemalloc` (Python objects and NumPy arrays, not the Agg pixel buffer).
+    """
+    global CHART_FIGURE
+
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure, SubplotParams
+
+    if CHART_FIGURE is None:
+        CHART_FIGURE = Figure()
+        FigureCanvasAgg(CHART_FIGURE)
+    figure = CHART_FIGURE
+    figure.set_size_inches(width / figure.dpi, height / figure.dpi)
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    (before, _) = tracemalloc.get_traced_memory()
+    try:
+        with plt.xkcd(), plt.rc_context(rc_params):
+            yield figure
+    finally:
+        figure.clear()
+        figure.subplotpars = SubplotParams()
+        (_, peak) = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+        print(f"Chart {name}: peak memory +{(peak - before) / 2 ** 20:.1f} MiB")
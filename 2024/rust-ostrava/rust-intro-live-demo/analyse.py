@@ -1,6 +1,14 @@
-import gc
 import glob
+import hashlib
+import io
+import multiprocessing
+import shutil
+import tarfile
+import urllib.request
+from pathlib import Path, PurePosixPath
+from typing import IO, Callable, Iterable, Iterator
 
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
@@ -10,64 +18,288 @@ from tqdm import tqdm
 # lib.rs source: http://lib.rs/data/downloads_csv.zip
 # https://hackaday.com/2019/03/07/make-xkcd-style-plots-from-python/
 
+DUMP_URL = "https://static.crates.io/db-dump.tar.gz"
 
-def create_crates_per_month():
-    df = pd.read_csv("data/crates.csv")
-    index = pd.to_datetime(df["created_at"])
-    df.set_index(index, inplace=True)
-    count_per_month = df.groupby([
-        df.index.year,
-        df.index.month
-    ])["name"].count()
-    accum_count_per_month = count_per_month.cumsum().reset_index(0).rename(
-        columns=dict(created_at="year", name="count")).reset_index().rename(
-        columns=dict(created_at="month")
-    )
-    accum_count_per_month["date"] = accum_count_per_month.apply(lambda r: f"{r['year']}-{r['month']}-01", axis=1)
-    accum_count_per_month = accum_count_per_month[["date", "count"]]
-    accum_count_per_month.to_csv("data/crates-per-month.csv", index=False)
+# Rows of the download dumps that are held in memory at once
+CHUNK_SIZE = 1_000_000
+
+DATA_DIR = Path("data")
+# Dump tables converted to Parquet, see `ingest_table`
+PARQUET_DIR = DATA_DIR / "parquet"
+# Bump when the conversion of the tables to Parquet changes (e.g. the parsing of dates)
+PARQUET_FORMAT_VERSION = 1
+# Per-period totals of the dump tables, see `update_totals`
+AGGREGATES_DIR = DATA_DIR / "aggregates"
+
+# Dump table -> its date column
+DUMP_TABLES = {
+    "crates": "created_at",
+    "package_version_downloads": "downloaded_at",
+    "version_downloads": "date",
+}
+
+# Dump table -> types of its columns. Other columns are dropped when the table is read. The
+# download tables have only a few distinct dates, so they are read as categories and each date
+# is parsed only once.
+TABLE_SCHEMAS = {
+    "crates": {"created_at": str, "name": str},
+    "package_version_downloads": {"downloaded_at": "category", "downloads": "uint32", "package_version": "int32"},
+    "version_downloads": {"date": "category", "downloads": "uint32", "version_id": "int32"},
+}
+
+
+def parse_dates(dates: pd.Series) -> pd.Series:
+    """Parses dates into UTC timestamps without a timezone, so that they compare with plain timestamps."""
+    if dates.dtype == "category":
+        # Parse only the distinct dates
+        return dates.cat.rename_categories(parse_dates(dates.cat.categories.to_series())).astype("datetime64[ns]")
+    return pd.to_datetime(dates, utc=True).dt.tz_convert(None)
+
+
+def read_csv_chunks(source: str | Path | IO[bytes], name: str, columns: list[str] | None = None,
+                    chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Reads a dump table from a CSV path or file object in chunks, with the types of its schema
+    and its date column parsed.
+    """
+    date_column = DUMP_TABLES[name]
+    schema = TABLE_SCHEMAS[name]
+    columns = columns or list(schema)
+    chunks = pd.read_csv(source, usecols=columns, dtype={column: schema[column] for column in columns},
+                         chunksize=chunk_size)
+    for chunk in chunks:
+        if date_column in chunk.columns:
+            chunk[date_column] = parse_dates(chunk[date_column])
+        yield chunk
+
+
+class TarMemberReader(io.RawIOBase):
+    """
+    Members of a tarball opened in stream mode fail on `seekable()`, which pandas calls.
+    This exposes them as plain unseekable files.
+    """
+
+    def __init__(self, member: IO[bytes]):
+        self.member = member
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.member.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
 
 
-def create_download_count():
-    def aggregate(path: str) -> pd.DataFrame:
+def stream_dump(source: str, tables: dict[str, tuple[list[str], Callable[[Iterator[pd.DataFrame]], None]]],
+                chunk_size: int = CHUNK_SIZE):
+    """
+    Reads the db-dump tarball (a path or URL) as a stream, in a single pass and without
+    extracting it. Each table in `tables` is passed as an iterator of chunks with the given
+    columns to its consumer, which has to process it before the next member is read.
+    Returns the results of the consumers by table.
+    """
+    results = {}
+    with (urllib.request.urlopen(source) if "://" in source else open(source, "rb")) as file:
+        with tarfile.open(fileobj=file, mode="r|gz") as tar:
+            for member in tar:
+                path = PurePosixPath(member.name)
+                if path.parent.name != "data" or path.suffix != ".csv" or path.stem not in tables:
+                    continue
+                print(f"Reading {member.name} from {source}")
+                (columns, consume) = tables[path.stem]
+                member = io.BufferedReader(TarMemberReader(tar.extractfile(member)))
+                results[path.stem] = consume(read_csv_chunks(member, path.stem, columns, chunk_size))
+    return results
+
+
+def table_format_key(name: str) -> str:
+    """Identifies the schema of a dump table and the Parquet conversion its parts were written with."""
+    schema = {column: getattr(dtype, "__name__", str(dtype)) for (column, dtype) in TABLE_SCHEMAS[name].items()}
+    return hashlib.sha1(repr((PARQUET_FORMAT_VERSION, DUMP_TABLES[name], schema)).encode()).hexdigest()
+
+
+def ingest_table(name: str, chunk_size: int = CHUNK_SIZE) -> Path:
+    """
+    Converts `data/<name>.csv` to Parquet parts of `chunk_size` rows with already parsed dates.
+    The conversion only happens once, until the CSV file, the schema of the table or
+    `PARQUET_FORMAT_VERSION` changes.
+    """
+    csv_path = DATA_DIR / f"{name}.csv"
+    table_dir = PARQUET_DIR / name
+    key_path = table_dir / "format-key"
+    key = table_format_key(name)
+    if (key_path.is_file() and key_path.read_text() == key
+            and table_dir.stat().st_mtime >= csv_path.stat().st_mtime):
+        return table_dir
+
+    print(f"Ingesting {csv_path}")
+    tmp_dir = PARQUET_DIR / f"{name}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    for (index, chunk) in enumerate(read_csv_chunks(csv_path, name, chunk_size=chunk_size)):
+        chunk.to_parquet(tmp_dir / f"part-{index:05}.parquet", index=False)
+    (tmp_dir / "format-key").write_text(key)
+    shutil.rmtree(table_dir, ignore_errors=True)
+    tmp_dir.rename(table_dir)
+    return table_dir
+
+
+def read_table(name: str, columns: list[str], since: pd.Timestamp | None = None) -> Iterator[pd.DataFrame]:
+    """
+    Yields the parts of a dump table one by one, with only the given columns and, if `since`
+    is given, only the rows dated at or after it.
+    """
+    filters = None if since is None else [(DUMP_TABLES[name], ">=", since)]
+    for part in sorted(ingest_table(name).glob("*.parquet")):
+        yield pd.read_parquet(part, columns=columns, filters=filters)
+
+
+def total_per_period(chunks: Iterable[pd.DataFrame], date_column: str, value_column: str, freq: str,
+                     how: str = "sum") -> pd.Series:
+    """
+    Totals (`sum` or `count`) of `value_column` per period. The table is processed in chunks, so
+    that memory usage does not grow with the size of the dump. Each chunk is folded into
+    per-period partial totals, which are then merged.
+    """
+    partial_totals = [pd.Series(dtype="int64", index=pd.PeriodIndex([], freq=freq))]
+    for chunk in chunks:
+        periods = chunk[date_column].dt.to_period(freq)
+        partial_totals.append(chunk[value_column].groupby(periods).agg(how).astype("int64"))
+    return pd.concat(partial_totals).groupby(level=0).sum()
+
+
+def update_totals(name: str, columns: list[str], value_column: str, freq: str, how: str = "sum",
+                  chunks: Iterable[pd.DataFrame] | None = None) -> pd.Series:
+    """
+    Returns the per-period totals of a dump table, persisted in `data/aggregates`. The last stored
+    period is the high-water mark of the table: only rows from its start on are read (from
+    `chunks` or the Parquet cache) and the totals of that period and later ones are replaced.
+    A rerun on a newer dump thus only processes the new data. Delete the stored totals after
+    changing how a table is aggregated. Without `chunks` and an extracted CSV of the table, the
+    stored totals are returned as they are.
+    """
+    path = AGGREGATES_DIR / f"{name}-{freq}-{how}.csv"
+    stored = pd.Series(dtype="int64", index=pd.PeriodIndex([], freq=freq))
+    if path.exists():
         df = pd.read_csv(path)
-        if "downloaded_at" in df.columns:
-            index = pd.to_datetime(df["downloaded_at"])
-            df.set_index(index, inplace=True)
-            df = df.resample("M")["downloads"].sum()
-            df = df.cumsum().reset_index()
-            df = df.rename(columns=dict(downloaded_at="date", downloads="count"))
-        else:
-            df = df.groupby("date")["downloads"].sum().cumsum().reset_index()
-            df = df.rename(columns=dict(downloads="count"))
-        return df
-
-    df = aggregate("data/package_version_downloads.csv")
-    gc.collect()
-    max = df["count"].max()
-    df2 = aggregate("data/version_downloads.csv")
-    df2["count"] = df2["count"] + max
+        stored = pd.Series(df["total"].to_numpy(), index=pd.PeriodIndex(df["period"], freq=freq))
+    if chunks is None and not (DATA_DIR / f"{name}.csv").exists():
+        print(f"{DATA_DIR / name}.csv not found, using the stored totals of {name}")
+        return stored
+
+    date_column = DUMP_TABLES[name]
+    mark = stored.index.max() if len(stored) else None
+    if chunks is None:
+        chunks = read_table(name, columns, since=None if mark is None else mark.start_time)
+    elif mark is not None:
+        chunks = (chunk[chunk[date_column] >= mark.start_time] for chunk in chunks)
+    new_totals = total_per_period(chunks, date_column, value_column, freq, how)
+    totals = pd.concat((stored[~stored.index.isin(new_totals.index)], new_totals)).sort_index()
+
+    AGGREGATES_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    pd.DataFrame({"period": totals.index.astype(str), "total": totals.to_numpy()}).to_csv(tmp_path, index=False)
+    tmp_path.replace(path)
+    return totals
+
+
+CRATES_COLUMNS = ["created_at", "name"]
+
+
+def create_crates_per_month(crates: Iterable[pd.DataFrame] | None = None):
+    count_per_month = update_totals("crates", CRATES_COLUMNS, "name", "M", how="count", chunks=crates)
+    accum_count_per_month = pd.DataFrame({
+        "date": [f"{month.year}-{month.month}-01" for month in count_per_month.index],
+        "count": count_per_month.cumsum().to_numpy(),
+    })
+    accum_count_per_month.to_csv("data/crates-per-month.csv", index=False)
+
+
+def downloads_per_month(downloads: pd.Series) -> pd.DataFrame:
+    """Cumulative downloads at the end of each month, including months without any downloads."""
+    months = pd.period_range(downloads.index.min(), downloads.index.max(), freq="M")
+    downloads = downloads.reindex(months, fill_value=0)
+    return pd.DataFrame({
+        "date": months.to_timestamp(how="end").normalize(),
+        "count": downloads.cumsum().to_numpy(),
+    })
+
+
+VERSION_DOWNLOADS_COLUMNS = ["date", "downloads"]
 
-    df = pd.concat((df, df2))
-    df.to_csv("data/crate-downloads-per-month.csv", index=False)
 
+def version_downloads_per_day(version_downloads: Iterable[pd.DataFrame] | None = None) -> pd.Series:
+    return update_totals("version_downloads", VERSION_DOWNLOADS_COLUMNS, "downloads", "D",
+                         chunks=version_downloads)
 
-def create_download_count_librs():
+
+def create_download_count(downloads_per_day: pd.Series | None = None):
+    """
+    Appends the daily downloads of the db-dump to the monthly downloads of the package download
+    dataset, which is not a part of the dump. Missing totals of the dataset are skipped.
+    """
     tables = []
-    for file in tqdm(sorted(glob.glob("data/librs_crate_downloads/*.csv"))):
-        df = pd.read_csv(file)
-        df.drop(columns=["crate_name", "version"], inplace=True)
-        df = df.fillna(0).transpose()
-        df = df.sum(axis=1)
-        df = df.reset_index()
-        df = df.rename(columns={"index": "date", 0: "count"})
+    max = 0
+    package_downloads = update_totals("package_version_downloads", ["downloaded_at", "downloads"],
+                                      "downloads", "M")
+    if len(package_downloads):
+        df = downloads_per_month(package_downloads)
+        max = df["count"].max()
         tables.append(df)
 
+    if downloads_per_day is None:
+        downloads_per_day = version_downloads_per_day()
+    df2 = pd.DataFrame({
+        "date": downloads_per_day.index.to_timestamp(),
+        "count": downloads_per_day.cumsum().to_numpy(),
+    })
+    df2["count"] = df2["count"] + max
+    tables.append(df2)
+
     df = pd.concat(tables)
-    df["count"] = df["count"].cumsum()
     df.to_csv("data/crate-downloads-per-month.csv", index=False)
 
 
-# create_crates_per_month()
-# create_download_count()
-create_download_count_librs()
+def analyse_dump(source: str = DUMP_URL):
+    """
+    Computes the crate statistics from a fresh db-dump tarball in a single pass. The download
+    count is created after the stream ends, from the stored totals of the package downloads.
+    """
+    results = stream_dump(source, {
+        "crates": (CRATES_COLUMNS, create_crates_per_month),
+        "version_downloads": (VERSION_DOWNLOADS_COLUMNS, version_downloads_per_day),
+    })
+    create_download_count(results.get("version_downloads"))
+
+
+def sum_librs_downloads(path: str) -> tuple[np.ndarray, np.ndarray]:
+    """Sums the downloads of all versions in a lib.rs crate file, returns (dates, downloads per date)."""
+    df = pd.read_csv(path)
+    dates = df.columns.drop(["crate_name", "version"])
+    downloads = np.nansum(df[dates].to_numpy(dtype=np.float64), axis=0)
+    return dates.to_numpy(dtype=str), downloads
+
+
+def create_download_count_librs(processes: int | None = None):
+    """
+    The crate files are summed in a process pool, each worker returns only a vector of downloads
+    per date. The vectors are then merged into a single accumulator indexed by date.
+    """
+    files = sorted(glob.glob("data/librs_crate_downloads/*.csv"))
+    with multiprocessing.Pool(processes) as pool:
+        partial_sums = list(tqdm(pool.imap(sum_librs_downloads, files, chunksize=16), total=len(files)))
+
+    dates, indices = np.unique(np.concatenate([dates for (dates, _) in partial_sums]), return_inverse=True)
+    downloads = np.bincount(indices, weights=np.concatenate([downloads for (_, downloads) in partial_sums]),
+                            minlength=len(dates))
+
+    df = pd.DataFrame({"date": dates, "count": downloads.cumsum()})
+    df.to_csv("data/crate-downloads-per-month.csv", index=False)
+
+
+if __name__ == "__main__":
+    # create_crates_per_month()
+    # create_download_count()
+    # analyse_dump()
+    create_download_count_librs()
@@ -1,8 +1,13 @@
+import hashlib
 import io
-from typing import Optional, Tuple, Union
+import json
+import os
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
 
 import elsie
 from elsie import Arrow, Slides, TextStyle as T
+from elsie.boxtree import boxmixin
 from elsie.boxtree.box import Box
 from elsie.boxtree.boxitem import BoxItem
 from elsie.ext import unordered_list
@@ -79,6 +84,37 @@ def code(parent: Box, code: str, language="rust", width=None, code_style="code",
     return codebox
 
 
+# Shared by all decks, identical snippets in different talks use the same entry
+HIGHLIGHT_CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "talks-highlight"
+
+
+def cached_highlight_code(code: str, language: str) -> List[Tuple]:
+    """
+    Replacement of elsie's `highlight_code` that stores the Pygments tokens on disk, keyed by
+    the language, the code and the Pygments/elsie versions.
+    """
+    import pygments
+    from elsie.text.highlight import highlight_code
+    from elsie.version import VERSION
+
+    hasher = hashlib.sha1(f"{pygments.__version__}/{VERSION}/{language}".encode())
+    hasher.update(code.encode())
+    path = HIGHLIGHT_CACHE_DIR / f"{hasher.hexdigest()}.json"
+    if path.is_file():
+        return [tuple(token) for token in json.loads(path.read_text())]
+
+    tokens = highlight_code(code, language)
+    HIGHLIGHT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(tokens))
+    tmp_path.replace(path)
+    return tokens
+
+
+# `Box.code` tokenizes snippets through this name
+boxmixin.highlight_code = cached_highlight_code
+
+
 def with_bg(parent: Box, bg_color="#DDDDDD") -> Box:
     quote = parent.box()
     quote.rect(bg_color=bg_color)
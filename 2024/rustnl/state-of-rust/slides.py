@@ -735,7 +735,7 @@ def package_count_growth(slide: Box):
     slide.box().text("Number of Rust packages")
 
     df = pd.read_csv("data/crates-per-month.csv")
-    plot = render_plot(df)
+    plot = render_plot("package-count", df)
     slide.box(width=sw(1400)).image(plot, image_type="png")
 
     source(slide, "~tt{crates.io}")
@@ -747,7 +747,7 @@ def package_download_chart(parent: Box, **box_args) -> Box:
     def formatter(value, *args) -> str:
         return f"{int(value // 10e8)} bil"
 
-    plot = render_plot(df, yaxis_formatter=formatter)
+    plot = render_plot("package-downloads", df, yaxis_formatter=formatter)
     parent.box().text("Rust package downloads")
     box = parent.box(width=sw(1400), **box_args)
     box.image(plot, image_type="png")
@@ -1,9 +1,16 @@
+import contextlib
+import hashlib
 import io
-from typing import Optional, Tuple, Union
+import json
+import os
+import tracemalloc
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
 
 import elsie
 import pandas as pd
 from elsie import Arrow, Slides, TextStyle as T
+from elsie.boxtree import boxmixin
 from elsie.boxtree.box import Box
 from elsie.boxtree.boxitem import BoxItem
 from elsie.ext import unordered_list
@@ -83,6 +90,37 @@ def code(parent: Box, code: str, language="rust", width=None, code_style="code",
     return codebox
 
 
+# Shared by all decks, identical snippets in different talks use the same entry
+HIGHLIGHT_CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "talks-highlight"
+
+
+def cached_highlight_code(code: str, language: str) -> List[Tuple]:
+    """
+    Replacement of elsie's `highlight_code` that stores the Pygments tokens on disk, keyed by
+    the language, the code and the Pygments/elsie versions.
+    """
+    import pygments
+    from elsie.text.highlight import highlight_code
+    from elsie.version import VERSION
+
+    hasher = hashlib.sha1(f"{pygments.__version__}/{VERSION}/{language}".encode())
+    hasher.update(code.encode())
+    path = HIGHLIGHT_CACHE_DIR / f"{hasher.hexdigest()}.json"
+    if path.is_file():
+        return [tuple(token) for token in json.loads(path.read_text())]
+
+    tokens = highlight_code(code, language)
+    HIGHLIGHT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(tokens))
+    tmp_path.replace(path)
+    return tokens
+
+
+# `Box.code` tokenizes snippets through this name
+boxmixin.highlight_code = cached_highlight_code
+
+
 def with_bg(parent: Box, bg_color="#DDDDDD", padding=10, **kwargs) -> Box:
     quote = parent.fbox()
     radius = 10
@@ -240,18 +278,53 @@ def source(slide: Box, text: str, show: Optional[str] = None):
     slide.box(show=show, x="[96%]", y="[98%]").text(text, T(size=sw(40)))
 
 
-def render_plot(data, yaxis_formatter=None):
-    import seaborn as sns
+CHART_FIGURE = None
+
+
+@contextlib.contextmanager
+def chart_figure(name: str, width: float, height: float, **rc_params):
+    """
+    Provides an empty xkcd-style figure of `width`x`height` pixels for a single chart.
+    All charts share one figure with an Agg canvas that is not registered with pyplot, so no
+    figures stay alive between charts. Prints the peak memory allocated while drawing the chart,
+    as traced by `tracemalloc` (Python objects and NumPy arrays, not the Agg pixel buffer).
+    """
+    global CHART_FIGURE
+
     import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure, SubplotParams
+
+    if CHART_FIGURE is None:
+        CHART_FIGURE = Figure()
+        FigureCanvasAgg(CHART_FIGURE)
+    figure = CHART_FIGURE
+    figure.set_size_inches(width / figure.dpi, height / figure.dpi)
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    (before, _) = tracemalloc.get_traced_memory()
+    try:
+        with plt.xkcd(), plt.rc_context(rc_params):
+            yield figure
+    finally:
+        figure.clear()
+        figure.subplotpars = SubplotParams()
+        (_, peak) = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+        print(f"Chart {name}: peak memory +{(peak - before) / 2 ** 20:.1f} MiB")
+
+
+def render_plot(name: str, data, yaxis_formatter=None):
+    import seaborn as sns
 
     data["date"] = pd.to_datetime(data["date"])
 
-    plt.clf()
-    with plt.xkcd():
-        px = 1 / plt.rcParams["figure.dpi"]
-        plt.figure(figsize=(1200 * px, 700 * px))
-
-        ax = sns.lineplot(data=data, x="date", y="count")
+    with chart_figure(name, 1200, 700) as figure:
+        ax = sns.lineplot(data=data, x="date", y="count", ax=figure.subplots())
         ax.tick_params(labelsize=20)
         ax.set_xlabel("Year", fontsize=20)
         ax.set_ylabel("Count", fontsize=20)
@@ -270,8 +343,8 @@ def render_plot(data, yaxis_formatter=None):
 
         buffer = io.BytesIO()
 
-        plt.tight_layout()
-        plt.savefig(buffer, format="png")
+        figure.tight_layout()
+        figure.savefig(buffer, format="png")
         buffer.seek(0)
     return buffer
 
@@ -1,8 +1,6 @@
 import os
-from pathlib import Path
 from typing import List, Optional
 
-from PIL import Image
 from elsie import Arrow, Slides
 from elsie.boxtree.box import Box
 from elsie import TextStyle as T
@@ -10,7 +8,7 @@ from elsie.boxtree.boxitem import BoxItem
 from elsie.ext import ordered_list, unordered_list
 
 from history import history
-from utils import dimmed_list_item, render_bot, code, iterate_grid, quotation, topic
+from utils import avatar_mosaic, dimmed_list_item, render_bot, code, quotation, topic
 
 
 def governance(slides: Slides):
@@ -161,28 +159,11 @@ def governance(slides: Slides):
         slide.box(width=500, height=300, x=220, y=40, show="1").rect(bg_color="#2E2459")
 
     def get_rust_project_image_path() -> str:
-        width = 65
-        height = 65
         rows = 15
         cols = 26
-        padding = 5
         images = sorted([f"avatars/{file}" for file in os.listdir("avatars")])
         assert rows * cols == len(images)
-
-        def generate(path: Path):
-            img = Image.new("RGBA", ((width + padding) * cols, (height + padding) * rows), "WHITE")
-            white_bg = Image.new("RGBA", (width, height), "WHITE")
-            for (image, (row, col)) in zip(images, iterate_grid(rows, cols, width, height, p_horizontal=padding, p_vertical=padding)):
-                avatar = Image.open(image).resize((width, height)).convert("RGBA")
-                avatar = Image.alpha_composite(white_bg, avatar)
-                img.paste(avatar, (col, row))
-            img.convert("RGBA").save(path)
-
-        key = Path(f"images/w{width}-h{height}-r{rows}-c{cols}-p{padding}.png")
-        if not key.is_file():
-            generate(key)
-
-        return str(key)
+        return avatar_mosaic(images, rows=rows, cols=cols, width=65, height=65, padding=5)
 
     @slides.slide()
     def rust_project_structure(slide: Box):
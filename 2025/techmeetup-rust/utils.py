@@ -1,8 +1,13 @@
+import hashlib
 import io
-from typing import Optional, Tuple, Union
+import json
+import os
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
 
 import elsie
 from elsie import Arrow, Slides, TextStyle as T
+from elsie.boxtree import boxmixin
 from elsie.boxtree.box import Box
 from elsie.boxtree.boxitem import BoxItem
 from elsie.ext import unordered_list
@@ -81,6 +86,37 @@ def code(parent: Box, code: str, language="rust", width=None, code_style="code",
     return codebox
 
 
+# Shared by all decks, identical snippets in different talks use the same entry
+HIGHLIGHT_CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "talks-highlight"
+
+
+def cached_highlight_code(code: str, language: str) -> List[Tuple]:
+    """
+    Replacement of elsie's `highlight_code` that stores the Pygments tokens on disk, keyed by
+    the language, the code and the Pygments/elsie versions.
+    """
+    import pygments
+    from elsie.text.highlight import highlight_code
+    from elsie.version import VERSION
+
+    hasher = hashlib.sha1(f"{pygments.__version__}/{VERSION}/{language}".encode())
+    hasher.update(code.encode())
+    path = HIGHLIGHT_CACHE_DIR / f"{hasher.hexdigest()}.json"
+    if path.is_file():
+        return [tuple(token) for token in json.loads(path.read_text())]
+
+    tokens = highlight_code(code, language)
+    HIGHLIGHT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(tokens))
+    tmp_path.replace(path)
+    return tokens
+
+
+# `Box.code` tokenizes snippets through this name
+boxmixin.highlight_code = cached_highlight_code
+
+
 def with_bg(parent: Box, bg_color="#DDDDDD") -> Box:
     quote = parent.box()
     quote.rect(bg_color=bg_color)
@@ -175,6 +211,79 @@ def iterate_grid(rows: int, cols: int, width: int, height: int, p_horizontal: in
         col = 0
 
 
+AVATAR_CACHE_DIR = Path("elsie-cache/avatars")
+
+
+def avatar_thumbnail(path: str, width: int, height: int):
+    """
+    Returns the avatar at `path` resized to `width`x`height` as an RGBA image.
+    Thumbnails are stored on disk keyed by the content hash of the avatar, so each original is
+    decoded only once per size.
+    """
+    from PIL import Image
+
+    digest = hashlib.sha1(Path(path).read_bytes()).hexdigest()
+    thumbnail_path = AVATAR_CACHE_DIR / f"{digest}-{width}x{height}.png"
+    if thumbnail_path.is_file():
+        return Image.open(thumbnail_path)
+
+    with Image.open(path) as image:
+        thumbnail = image.resize((width, height)).convert("RGBA")
+    AVATAR_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = thumbnail_path.with_suffix(".tmp")
+    thumbnail.save(tmp_path, format="PNG")
+    tmp_path.replace(thumbnail_path)
+    return thumbnail
+
+
+MOSAIC_CACHE_DIR = Path("elsie-cache/mosaics")
+
+
+def avatar_mosaic(images: List[str], rows: int, cols: int, width: int, height: int,
+                  padding: int) -> str:
+    """
+    Composes avatars (row by row) into a grid of `rows`x`cols` tiles separated by `padding`
+    white pixels and returns the path to the resulting PNG.
+    Each row of tiles is blended over white in a single NumPy pass and pasted into a
+    preallocated sheet, so besides the sheet itself only one band of rows is in memory.
+    The sheet is keyed by the grid geometry and the contents of all avatars, so adding or
+    changing an avatar creates a new sheet.
+    """
+    import numpy as np
+    from PIL import Image
+
+    assert len(images) <= rows * cols
+    hasher = hashlib.sha1(repr((rows, cols, width, height, padding)).encode())
+    for image in images:
+        hasher.update(hashlib.sha1(Path(image).read_bytes()).digest())
+    path = MOSAIC_CACHE_DIR / f"{hasher.hexdigest()}.png"
+    if path.is_file():
+        return str(path)
+
+    cell_height = height + padding
+    cell_width = width + padding
+    sheet = Image.new("RGB", (cols * cell_width, rows * cell_height), "white")
+    for row in range(rows):
+        row_images = images[row * cols:(row + 1) * cols]
+        if not row_images:
+            break
+        tiles = np.stack([np.asarray(avatar_thumbnail(image, width, height)) for image in row_images])
+        rgb = tiles[..., :3].astype(np.uint32)
+        alpha = tiles[..., 3:].astype(np.uint32)
+        blended = (rgb * alpha + 255 * (255 - alpha) + 127) // 255
+        band = np.full((height, len(row_images), cell_width, 3), 255, dtype=np.uint8)
+        # (tiles, height, width, 3) -> (height, tiles, width, 3)
+        band[:, :, :width] = blended.transpose(1, 0, 2, 3)
+        sheet.paste(Image.fromarray(band.reshape(height, len(row_images) * cell_width, 3)),
+                    (0, row * cell_height))
+
+    MOSAIC_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    sheet.save(tmp_path, format="PNG")
+    tmp_path.replace(path)
+    return str(path)
+
+
 def big_text_slide(slide: Box, text: str):
     slide.box().text(text, style=T(size=60, bold=True))
 
@@ -1,5 +1,6 @@
 import json
 import math
+import os
 import subprocess
 from typing import List, Tuple
 
@@ -7,12 +8,12 @@ import elsie
 from elsie import SlideDeck, TextStyle
 from elsie.boxtree.box import Box
 from elsie.ext import unordered_list
-from elsie.render.backends import InkscapeBackend
 from elsie.render.inkscape import InkscapeShell
 from elsie.text.textboxitem import TextBoxItem
 from elsie.text.textstyle import TextStyle as T
 
 from config import HEIGHT, REFERENCE_HEIGHT, REFERENCE_WIDTH, WIDTH, sh, sw
+from render import make_backend, render_slides
 from tip_async import async_tests
 from tip_compile_time_tests import compile_time_tests
 from tip_data_driven_tests import data_driven_tests
@@ -30,12 +31,18 @@ from utils import COLOR_ORANGE, LOWER_OPACITY, StateCounter, bash, code, dimmed_
     iterate_grid, project
 
 PRODUCTION_BUILD = True
+RENDER_WORKERS = os.cpu_count()
+INKSCAPE_BIN = "/usr/bin/inkscape"
 
 BG_PURPLE = "#211660"
 
-backend = InkscapeBackend(InkscapeShell("/usr/bin/inkscape", text_to_path=True))
+
+def inkscape_shell() -> InkscapeShell:
+    return InkscapeShell(INKSCAPE_BIN, text_to_path=True)
+
+
+backend = make_backend(INKSCAPE_BIN, inkscape_shell, pool_size=RENDER_WORKERS)
 slides = elsie.SlideDeck(name_policy="ignore", width=WIDTH, height=HEIGHT, backend=backend)
-# slides = elsie.SlideDeck(name_policy="ignore", backend=CairoBackend())
 
 slides.update_style("default",
                     TextStyle(font="Raleway", variant_numeric="lining-nums", size=70))
@@ -493,6 +500,6 @@ if PRODUCTION_BUILD:
     print_stats(slides, minutes=45)
 
 # if PRODUCTION_BUILD:
-#     slides.render("slides.pdf", slide_postprocessing=page_numbering)
+#     render_slides(slides, "slides.pdf", slide_postprocessing=page_numbering)
 # else:
-slides.render("slides.pdf")
+render_slides(slides, "slides.pdf", workers=RENDER_WORKERS, inkscape_factory=inkscape_shell)
@@ -1,10 +1,31 @@
 from elsie import Arrow, Slides, TextStyle as T
 from elsie.boxtree.box import Box
 
-from utils import StateCounter, code, project, render_rustc_error
+from utils import StateCounter, code, prefetch_rustc_errors, project, render_rustc_error
+
+STATIC_SIZE_ASSERT = """
+pub struct Attribute {
+    pub kind: AttrKind,
+    pub id: AttrId,
+    pub style: AttrStyle,
+    pub span: Span,
+}
+
+const AssertAttributeSize: [(); 32] = 
+    [(); std::mem::size_of::<Attribute>()];
+"""
+STATIC_SIZE_ASSERT_ERROR = """
+struct AttrKind([u8; 16]);
+struct AttrId([u8; 24]);
+struct AttrStyle([u8; 4]);
+struct Span([u8; 4]);
+""" + STATIC_SIZE_ASSERT
 
 
 def compile_time_tests(slides: Slides, tips: StateCounter):
+    # Compile all rustc errors used by the slides below at once
+    prefetch_rustc_errors([STATIC_SIZE_ASSERT_ERROR])
+
     @slides.slide()
     def compile_time_tests(slide: Box):
         tips.tip(slide, "Leverage compile-time tests")
@@ -101,23 +122,6 @@ VALUES ($1, $2, $3, $4, $5)
         slide.update_style("code", T(size=40))
 
         project(slide, "Rust compiler")
-        rust_code = """
-pub struct Attribute {
-    pub kind: AttrKind,
-    pub id: AttrId,
-    pub style: AttrStyle,
-    pub span: Span,
-}
-
-const AssertAttributeSize: [(); 32] = 
-    [(); std::mem::size_of::<Attribute>()];
-"""
-        code(slide.box(), rust_code)
-
-        extended_code = """
-struct AttrKind([u8; 16]);
-struct AttrId([u8; 24]);
-struct AttrStyle([u8; 4]);
-struct Span([u8; 4]);
-""" + rust_code
-        render_rustc_error(slide.box(show="next+", p_top=60), extended_code, style=T(size=26))
+        code(slide.box(), STATIC_SIZE_ASSERT)
+        render_rustc_error(slide.box(show="next+", p_top=60), STATIC_SIZE_ASSERT_ERROR,
+                           style=T(size=26))
@@ -5,7 +5,8 @@ from elsie import Arrow, Slides, TextStyle as T
 from elsie.boxtree.box import Box
 from elsie.ext import unordered_list
 
-from utils import HideRest, ShowRest, StateCounter, code_step, last, quotation, show, skip
+from utils import HideRest, ShowRest, StateCounter, cached_chart, chart_figure, code_step, last, \
+    quotation, show, skip
 
 
 def do_not_stress_metrics(slides: Slides, tips: StateCounter):
@@ -59,15 +60,11 @@ fn test1() {
     @slides.slide()
     def coverage_chart(slide: Box):
         import seaborn as sns
-        import matplotlib.pyplot as plt
 
+        @cached_chart
         def render_chart(x: List[int], y: List[int]) -> io.BytesIO:
-            plt.clf()
-            with plt.xkcd():
-                px = 1 / plt.rcParams["figure.dpi"]
-                plt.figure(figsize=(1200 * px, 700 * px))
-
-                ax = sns.lineplot(x=x, y=y)
+            with chart_figure("coverage", 1200, 700) as figure:
+                ax = sns.lineplot(x=x, y=y, ax=figure.subplots())
                 ax.tick_params(labelsize=20)
                 ax.set_xlabel("Situations covered by tests", fontsize=36)
                 ax.set_ylabel("(Line) code coverage (%)", fontsize=36)
@@ -78,8 +75,8 @@ fn test1() {
 
                 buffer = io.BytesIO()
 
-                plt.tight_layout()
-                plt.savefig(buffer, format="png")
+                figure.tight_layout()
+                figure.savefig(buffer, format="png")
                 buffer.seek(0)
             return buffer
 
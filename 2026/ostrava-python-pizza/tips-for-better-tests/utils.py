@@ -1,10 +1,20 @@
+import contextlib
+import functools
+import hashlib
+import inspect
 import io
 import json
+import os
 import subprocess
-from typing import List, Optional, Tuple, Union
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple, Union
 
 import elsie
 from elsie import Arrow, Slides, TextStyle as T
+from elsie.boxtree import boxmixin
 from elsie.boxtree.box import Box
 from elsie.boxtree.boxitem import BoxItem
 from elsie.ext import unordered_list
@@ -103,10 +113,13 @@ def list_item(parent, level=0, bullet="•", bullet_style="default", **box_args)
     return b.box(width="fill")
 
 
+CODE_BG_COLOR = "#EEEEEE"
+
+
 def code(parent: Box, code: str, language="python", width=None, code_style="code", p_right=50,
          return_codebox=False, **code_kwargs) -> Union[Box, TextBoxItem]:
     content = parent.box(width=width)
-    content.rect(bg_color="#EEEEEE")
+    content.rect(bg_color=CODE_BG_COLOR)
     box = content.box(p_left=10, p_right=p_right, p_y=10, z_level=100, x=0)
     codebox = box.code(language, code.strip(), style=code_style, **code_kwargs)
     if return_codebox:
@@ -114,6 +127,37 @@ def code(parent: Box, code: str, language="python", width=None, code_style="code
     return box
 
 
+# Shared by all decks, identical snippets in different talks use the same entry
+HIGHLIGHT_CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "talks-highlight"
+
+
+def cached_highlight_code(code: str, language: str) -> List[Tuple]:
+    """
+    Replacement of elsie's `highlight_code` that stores the Pygments tokens on disk, keyed by
+    the language, the code and the Pygments/elsie versions.
+    """
+    import pygments
+    from elsie.text.highlight import highlight_code
+    from elsie.version import VERSION
+
+    hasher = hashlib.sha1(f"{pygments.__version__}/{VERSION}/{language}".encode())
+    hasher.update(code.encode())
+    path = HIGHLIGHT_CACHE_DIR / f"{hasher.hexdigest()}.json"
+    if path.is_file():
+        return [tuple(token) for token in json.loads(path.read_text())]
+
+    tokens = highlight_code(code, language)
+    HIGHLIGHT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(tokens))
+    tmp_path.replace(path)
+    return tokens
+
+
+# `Box.code` tokenizes snippets through this name
+boxmixin.highlight_code = cached_highlight_code
+
+
 def with_bg(parent: Box, bg_color="#DDDDDD") -> Box:
     quote = parent.box()
     quote.rect(bg_color=bg_color)
@@ -171,11 +215,73 @@ def last(n: int) -> List[int]:
     return [v * -1 for v in reversed(range(1, n + 1))]
 
 
+def resolve_line_step(lines: List[str], visible_lines) -> List[Union[int, str, None]]:
+    actual_lines = []
+    rest_skip = 0
+    for (index, item) in enumerate(visible_lines):
+        if item is ShowRest:
+            assert index == len(visible_lines) - 1
+            actual_lines += list(
+                range(index,
+                      index + ((len(lines) - len(actual_lines)) - rest_skip)))
+        elif item is HideRest:
+            assert index == len(visible_lines) - 1
+            actual_lines += [None] * ((len(lines) - len(actual_lines)) - rest_skip)
+        elif item is Skip:
+            rest_skip += 1
+            continue
+        else:
+            actual_lines.append(item)
+    return actual_lines
+
+
+def is_maskable_step(lines: List[str], actual_lines: List[Union[int, str, None]]) -> bool:
+    """
+    Returns True if the step only hides some lines of the snippet, without reordering or
+    replacing them.
+    """
+    if len(actual_lines) != len(lines):
+        return False
+    return all(visible is None or (isinstance(visible, int) and visible % len(lines) == index)
+               for (index, visible) in enumerate(actual_lines))
+
+
 def code_step(parent: Box, code_content: str, line_steps, show_start: int = 1, **code_args):
     show_start = int(show_start)
 
     code_content = code_content.strip()
     lines = code_content.split("\n")
+    steps = [resolve_line_step(lines, visible_lines) for visible_lines in line_steps]
+
+    def get_show(step: int) -> str:
+        show = str(step + show_start)
+        if step == len(steps) - 1:
+            show += "+"
+        return show
+
+    if all(is_maskable_step(lines, actual_lines) for actual_lines in steps):
+        # Highlight and lay out the snippet only once, hidden lines are covered by masks
+        return_codebox = code_args.pop("return_codebox", False)
+        codebox = code(parent.overlay(show=f"{show_start}+"), code_content, return_codebox=True,
+                       **code_args)
+        for (step, actual_lines) in enumerate(steps):
+            hidden = [visible is None for visible in actual_lines]
+            index = 0
+            while index < len(lines):
+                if not hidden[index]:
+                    index += 1
+                    continue
+                count = 1
+                while index + count < len(lines) and hidden[index + count]:
+                    count += 1
+                codebox.line_box(index, n_lines=count, show=get_show(step),
+                                 z_level=101).rect(bg_color=CODE_BG_COLOR)
+                index += count
+        # Keep the step count even when the last steps do not hide anything
+        parent.overlay(show=get_show(len(steps) - 1))
+        if return_codebox:
+            return codebox
+        return codebox._get_box()
 
     def get_line(lines, visible):
         if visible is None:
@@ -186,28 +292,8 @@ def code_step(parent: Box, code_content: str, line_steps, show_start: int = 1, *
             return visible
 
     last = None
-    for (step, visible_lines) in enumerate(line_steps):
-        actual_lines = []
-        rest_skip = 0
-        for (index, item) in enumerate(visible_lines):
-            if item is ShowRest:
-                assert index == len(visible_lines) - 1
-                actual_lines += list(
-                    range(index,
-                          index + ((len(lines) - len(actual_lines)) - rest_skip)))
-            elif item is HideRest:
-                assert index == len(visible_lines) - 1
-                actual_lines += [None] * ((len(lines) - len(actual_lines)) - rest_skip)
-            elif item is Skip:
-                rest_skip += 1
-                continue
-            else:
-                actual_lines.append(item)
-
-        show = str(step + show_start)
-        if step == len(line_steps) - 1:
-            show += "+"
-        wrapper = parent.overlay(show=show)
+    for (step, actual_lines) in enumerate(steps):
+        wrapper = parent.overlay(show=get_show(step))
 
         current_lines = [get_line(lines, visible) for visible in actual_lines]
         last = code(wrapper, "\n".join(current_lines), **code_args)
@@ -339,17 +425,36 @@ def arrow_box(box: Box, text: Optional[str] = None, both_sides: bool = False, **
     if text is not None:
         box.box(x=box.x("0"), y=box.y("100%").add(30), width=box.layout.width_definition).text(text, T(**text_args))
 
-def render_rustc_error(box: Box, code: str, **text_args) -> TextBoxItem:
+RUSTC_CACHE_DIR = Path("elsie-cache/rustc")
+# Bump when the rendering of the errors (styles, filtered lines) changes
+RUSTC_ERROR_CACHE_VERSION = 1
+
+
+@functools.lru_cache
+def rustc_version() -> str:
+    return subprocess.run(["rustc", "--version"], capture_output=True, check=True).stdout.decode()
+
+
+def rustc_error_cache_path(code: str) -> Path:
+    hasher = hashlib.sha1(f"{RUSTC_ERROR_CACHE_VERSION}/{rustc_version()}".encode())
+    hasher.update(code.encode())
+    return RUSTC_CACHE_DIR / f"{hasher.hexdigest()}.txt"
+
+
+def compile_rustc_error(code: str) -> str:
+    """
+    Compiles `code` with rustc and returns its first error with the ANSI colors converted to
+    elsie styles. The result is cached on disk, keyed by the code, the rustc version and
+    `RUSTC_ERROR_CACHE_VERSION`.
+    """
+    path = rustc_error_cache_path(code)
+    if path.is_file():
+        return path.read_text()
+
     import stransi
     from stransi.color import ColorRole
     from stransi import Ansi
 
-    box.update_style("default", box.get_style("tt").compose(T(align="left")))
-    box.set_style("ansi_red", T(color="red"))
-    box.set_style("ansi_blue", T(color="#40A0FF"))
-    box.set_style("ansi_aqua", T(color="#00FFFF"))
-    box.set_style("ansi_green", T(color="#00CC00"))
-    box.set_style("ansi_olive", T(color="#808000"))
     color_styles = {
         3: "ansi_olive",
         9: "ansi_red",
@@ -361,55 +466,168 @@ def render_rustc_error(box: Box, code: str, **text_args) -> TextBoxItem:
     def show_line(line: str) -> bool:
         return "this error originates" not in line
 
-    output = subprocess.run([
-        "rustc",
-        "--crate-type", "rlib",
-        "--error-format=json",
-        "--json",
-        "diagnostic-rendered-ansi",
-        "-"
-    ], input=code.encode("utf8"),
-        capture_output=True)
-    assert output.returncode != 0
-    output = output.stderr.decode()
-    for line in output.splitlines():
-        msg = json.loads(line)
-        if msg["$message_type"] == "diagnostic":
-            if msg["level"] == "error":
-                rendered = msg["rendered"]
-                lines = "\n".join([l for l in rendered.splitlines() if show_line(l)])
-
-                output = ""
-                styles = []
-
-                def push(style: str):
-                    nonlocal output, styles
-                    output += f"~{style}{{"
-                    styles.append(style)
-
-                def pop_all():
-                    nonlocal output, styles
-                    for _ in styles:
-                        output += "}"
-                    styles.clear()
-
-                for item in Ansi(lines).escapes():
-                    if isinstance(item, stransi.Escape):
-                        for inst in item.instructions():
-                            if isinstance(inst,
-                                          stransi.SetAttribute) and inst.attribute == stransi.attribute.Attribute.BOLD:
-                                push("bold")
-                            elif isinstance(inst,
-                                            stransi.SetAttribute) and inst.attribute == stransi.attribute.Attribute.NORMAL:
-                                pop_all()
-                            elif isinstance(inst,
-                                            stransi.SetColor) and inst.role == ColorRole.FOREGROUND:
-                                push(color_styles[inst.color.ansi256.code])
-                    else:
-                        output += item
-                return box.text(output, **text_args)
-    raise Exception(f"No error found in:\n{code}")
+    def render() -> str:
+        output = subprocess.run([
+            "rustc",
+            "--crate-type", "rlib",
+            "--error-format=json",
+            "--json",
+            "diagnostic-rendered-ansi",
+            "-"
+        ], input=code.encode("utf8"),
+            capture_output=True)
+        assert output.returncode != 0
+        output = output.stderr.decode()
+        for line in output.splitlines():
+            msg = json.loads(line)
+            if msg["$message_type"] == "diagnostic":
+                if msg["level"] == "error":
+                    rendered = msg["rendered"]
+                    lines = "\n".join([l for l in rendered.splitlines() if show_line(l)])
+
+                    output = ""
+                    styles = []
+
+                    def push(style: str):
+                        nonlocal output, styles
+                        output += f"~{style}{{"
+                        styles.append(style)
+
+                    def pop_all():
+                        nonlocal output, styles
+                        for _ in styles:
+                            output += "}"
+                        styles.clear()
+
+                    for item in Ansi(lines).escapes():
+                        if isinstance(item, stransi.Escape):
+                            for inst in item.instructions():
+                                if isinstance(inst,
+                                              stransi.SetAttribute) and inst.attribute == stransi.attribute.Attribute.BOLD:
+                                    push("bold")
+                                elif isinstance(inst,
+                                                stransi.SetAttribute) and inst.attribute == stransi.attribute.Attribute.NORMAL:
+                                    pop_all()
+                                elif isinstance(inst,
+                                                stransi.SetColor) and inst.role == ColorRole.FOREGROUND:
+                                    push(color_styles[inst.color.ansi256.code])
+                        else:
+                            output += item
+                    return output
+        raise Exception(f"No error found in:\n{code}")
+
+    output = render()
+    RUSTC_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+    tmp_path.write_text(output)
+    tmp_path.replace(path)
+    return output
+
+
+def prefetch_rustc_errors(snippets: List[str]):
+    """
+    Compiles all snippets that are not cached yet concurrently, so that the slides
+    only read the finished errors from the cache.
+    """
+    missing = [code for code in snippets if not rustc_error_cache_path(code).is_file()]
+    if missing:
+        with ThreadPoolExecutor(min(len(missing), os.cpu_count() or 1)) as pool:
+            list(pool.map(compile_rustc_error, missing))
+
+
+def render_rustc_error(box: Box, code: str, **text_args) -> TextBoxItem:
+    box.update_style("default", box.get_style("tt").compose(T(align="left")))
+    box.set_style("ansi_red", T(color="red"))
+    box.set_style("ansi_blue", T(color="#40A0FF"))
+    box.set_style("ansi_aqua", T(color="#00FFFF"))
+    box.set_style("ansi_green", T(color="#00CC00"))
+    box.set_style("ansi_olive", T(color="#808000"))
+    return box.text(compile_rustc_error(code), **text_args)
 
 def error_message(parent: Box, text: str):
     parent.rect(bg_color="#1E1F22")
     parent.box(padding=10, x=0).text(text, T(color="#FF6B68", align="left", size=64))
+
+
+CHART_CACHE_DIR = Path("elsie-cache/charts")
+
+
+def hash_chart_argument(hasher, value):
+    import pandas as pd
+
+    if isinstance(value, pd.DataFrame):
+        hasher.update(repr((list(value.columns), list(value.dtypes))).encode())
+        hasher.update(pd.util.hash_pandas_object(value).values.tobytes())
+    else:
+        hasher.update(repr(value).encode())
+
+
+def cached_chart(render_fn: Callable[..., io.BytesIO]) -> Callable[..., io.BytesIO]:
+    """
+    Stores the rendered chart on disk, keyed by the chart arguments (DataFrames by their content),
+    the source code of the render function and the matplotlib/seaborn versions.
+    """
+
+    @functools.wraps(render_fn)
+    def wrapper(*args, **kwargs) -> io.BytesIO:
+        import matplotlib
+        import seaborn
+
+        hasher = hashlib.sha1(f"{matplotlib.__version__}/{seaborn.__version__}".encode())
+        hasher.update(inspect.getsource(render_fn).encode())
+        for arg in args:
+            hash_chart_argument(hasher, arg)
+        for (name, arg) in sorted(kwargs.items()):
+            hasher.update(name.encode())
+            hash_chart_argument(hasher, arg)
+
+        path = CHART_CACHE_DIR / f"{hasher.hexdigest()}.png"
+        if not path.is_file():
+            CHART_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            buffer = render_fn(*args, **kwargs)
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_bytes(buffer.getvalue())
+            tmp_path.replace(path)
+        return io.BytesIO(path.read_bytes())
+
+    return wrapper
+
+
+CHART_FIGURE = None
+
+
+@contextlib.contextmanager
+def chart_figure(name: str, width: float, height: float, **rc_params):
+    """
+    Provides an empty xkcd-style figure of `width`x`height` pixels for a single chart.
+    All charts share one figure with an Agg canvas that is not registered with pyplot, so no
+    figures stay alive between charts. Prints the peak memory allocated while drawing the chart,
+    as traced by `tracemalloc` (Python objects and NumPy arrays, not the Agg pixel buffer).
+    """
+    global CHART_FIGURE
+
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure, SubplotParams
+
+    if CHART_FIGURE is None:
+        CHART_FIGURE = Figure()
+        FigureCanvasAgg(CHART_FIGURE)
+    figure = CHART_FIGURE
+    figure.set_size_inches(width / figure.dpi, height / figure.dpi)
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    (before, _) = tracemalloc.get_traced_memory()
+    try:
+        with plt.xkcd(), plt.rc_context(rc_params):
+            yield figure
+    finally:
+        figure.clear()
+        figure.subplotpars = SubplotParams()
+        (_, peak) = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+        print(f"Chart {name}: peak memory +{(peak - before) / 2 ** 20:.1f} MiB")
@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of fetch_contributors.py.
+
+The fetcher runs against a local server that replays recorded (or synthetic) responses of the
+GitHub API, the Rust team API and the avatar host, and against local bare repositories.
+For each stage of the pipeline, the benchmark reports wall time, number of requests and
+transferred bytes.
+
+    # Record fixtures from the real services (needs network access)
+    $ python3 bench_contributors.py record fixtures
+    # Or generate synthetic fixtures
+    $ python3 bench_contributors.py synthesize fixtures --users 300 --commits 5000
+    # Run the benchmark (twice, to also measure a rerun with warm caches)
+    $ python3 bench_contributors.py bench fixtures --latency 0.05 --runs 2
+"""
+
+import argparse
+import base64
+import collections
+import functools
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+# Hosts whose responses are recorded, they are served under /<host>/ by the fixture server
+HOSTS = ["api.github.com", "team-api.infra.rust-lang.org", "avatars.githubusercontent.com"]
+TEAM_API_PATH = "team-api.infra.rust-lang.org/v1/people.json"
+
+STAGES = ["team", "contributors", "scanning", "resolution", "avatars"]
+
+# 1x1 transparent PNG
+SYNTHETIC_AVATAR = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+
+def fixture_key(method: str, host: str, path: str, query: str) -> str:
+    query = urlencode(sorted(parse_qsl(query, keep_blank_values=True)))
+    return f"{method} {host}{path}" + (f"?{query}" if query else "")
+
+
+def make_fixture(status: int, body: bytes, headers: dict | None = None) -> dict:
+    return {"status": status, "headers": headers or {}, "body": base64.b64encode(body).decode()}
+
+
+def json_fixture(data, status: int = 200) -> dict:
+    return make_fixture(status, json.dumps(data).encode(), {"Content-Type": "application/json"})
+
+
+def parse_graphql_users(query: str) -> list[tuple[str, str]]:
+    """Returns (alias, login) pairs of the aliased `user` fields of a lookup_users_graphql query."""
+    return [(alias, json.loads(login)) for alias, login in
+            re.findall(r'(\w+): user\(login: ("(?:[^"\\]|\\.)*")\)', query)]
+
+
+def stage_of(host: str, path: str) -> str:
+    if host == "team-api.infra.rust-lang.org":
+        return "team"
+    if host == "avatars.githubusercontent.com":
+        return "avatars"
+    if re.fullmatch(r"/repos/[^/]+/[^/]+/contributors", path):
+        return "contributors"
+    return "resolution"
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """
+    Replays recorded responses with an artificial latency and enforces GitHub-like rate limits
+    (with X-RateLimit-* headers and 403 responses). GraphQL user lookups are answered from the
+    recorded /users/<login> responses.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, fixtures: dict, latency: float, limits: dict[str, tuple[int, float]]):
+        super().__init__(("127.0.0.1", 0), FixtureHandler)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.limits = limits
+        self.windows = {}  # resource -> (window start, used requests)
+        self.lock = threading.Lock()
+        self.stats = collections.defaultdict(lambda: {"requests": 0, "bytes": 0})
+        self.missing = set()
+        self.rate_limited = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def take_rate_limit(self, resource: str) -> tuple[bool, dict]:
+        limit, period = self.limits[resource]
+        with self.lock:
+            now = time.time()
+            start, used = self.windows.get(resource, (now, 0))
+            if now - start >= period:
+                start, used = now, 0
+            allowed = used < limit
+            if allowed:
+                used += 1
+            else:
+                self.rate_limited += 1
+            self.windows[resource] = (start, used)
+        return allowed, {"X-RateLimit-Limit": str(limit), "X-RateLimit-Remaining": str(limit - used),
+                         "X-RateLimit-Reset": str(int(start + period) + 1), "X-RateLimit-Resource": resource}
+
+    def rewrite_urls(self, body: bytes) -> bytes:
+        for host in HOSTS:
+            body = body.replace(f"https://{host}".encode(), f"{self.base_url}/{host}".encode())
+        return body
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FixtureServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request("GET", b"")
+
+    def do_POST(self):
+        self.handle_request("POST", self.rfile.read(int(self.headers.get("Content-Length", 0))))
+
+    def handle_request(self, method: str, body: bytes):
+        time.sleep(self.server.latency)
+        url = urlsplit(self.path)
+        _, host, path = url.path.split("/", 2)
+        path = f"/{path}"
+
+        headers = {}
+        if host == "api.github.com":
+            resource = "graphql" if path == "/graphql" else "search" if path.startswith("/search/") else "core"
+            allowed, headers = self.server.take_rate_limit(resource)
+            if not allowed:
+                return self.reply(host, path, json_fixture({"message": "API rate limit exceeded"}, 403), headers)
+
+        if method == "POST" and path == "/graphql":
+            fixture = self.graphql_fixture(json.loads(body)["query"])
+        else:
+            key = fixture_key(method, host, path, url.query)
+            fixture = self.server.fixtures.get(key)
+            if fixture is None:
+                self.server.missing.add(key)
+                fixture = json_fixture({"message": "Not Found"}, 404)
+        etag = fixture["headers"].get("ETag")
+        if etag is not None and self.headers.get("If-None-Match") == etag:
+            fixture = make_fixture(304, b"", {"ETag": etag})
+        self.reply(host, path, fixture, headers)
+
+    def graphql_fixture(self, query: str) -> dict:
+        data = {}
+        for alias, login in parse_graphql_users(query):
+            fixture = self.server.fixtures.get(fixture_key("GET", "api.github.com", f"/users/{login}", ""))
+            if fixture is not None and fixture["status"] == 200:
+                user = json.loads(base64.b64decode(fixture["body"]))
+                data[alias] = {"login": user["login"], "avatarUrl": user["avatar_url"]}
+            else:
+                data[alias] = None
+        return json_fixture({"data": data})
+
+    def reply(self, host: str, path: str, fixture: dict, extra_headers: dict):
+        body = self.server.rewrite_urls(base64.b64decode(fixture["body"]))
+        self.send_response(fixture["status"])
+        for name, value in {**fixture["headers"], **extra_headers}.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+        stats = self.server.stats[stage_of(host, path)]
+        with self.server.lock:
+            stats["requests"] += 1
+            stats["bytes"] += len(body)
+
+
+def git(*args: str, **kwargs) -> str:
+    return subprocess.run(["git", *args], check=True, capture_output=True, text=True, **kwargs).stdout
+
+
+def create_fixture_repo(path: Path, source: str):
+    git("clone", "--bare", "--quiet", source, str(path))
+    # Allow the fetcher to make blobless clones of the fixture
+    git("-C", str(path), "config", "uploadpack.allowFilter", "true")
+
+
+def record(fixture_dir: Path):
+    """Run the fetcher against the real services and record every response and repository."""
+    import fetch_contributors
+
+    fixtures = {}
+    lock = threading.Lock()
+
+    def record_response(resp, *args, **kwargs):
+        url = urlsplit(resp.request.url)
+        if url.hostname not in HOSTS:
+            return
+        with lock:
+            if url.path == "/graphql":
+                # Store the looked up users as REST responses, the server answers GraphQL from them
+                users = resp.json().get("data") or {}
+                for alias, login in parse_graphql_users(json.loads(resp.request.body)["query"]):
+                    user = users.get(alias)
+                    key = fixture_key("GET", url.hostname, f"/users/{login}", "")
+                    if user:
+                        fixtures[key] = json_fixture({"login": user["login"], "avatar_url": user["avatarUrl"]})
+                    else:
+                        fixtures[key] = json_fixture({"message": "Not Found"}, 404)
+                return
+            headers = {name: resp.headers[name] for name in ("Content-Type", "ETag", "Last-Modified")
+                       if name in resp.headers}
+            key = fixture_key(resp.request.method, url.hostname, url.path, url.query)
+            fixtures[key] = make_fixture(resp.status_code, resp.content, headers)
+
+    fetch_contributors.SESSION.hooks["response"].append(record_response)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        use_work_dirs(fetch_contributors, Path(tmpdir))
+        fetch_contributors.main()
+
+    fixture_dir.mkdir(parents=True, exist_ok=True)
+    (fixture_dir / "responses.json").write_text(json.dumps(fixtures, indent=1, sort_keys=True))
+    for label, url in fetch_contributors.REPOS:
+        repo_path = fixture_dir / "repos" / f"{label.replace('/', '_')}.git"
+        if not repo_path.exists():
+            create_fixture_repo(repo_path, url)
+    print(f"Recorded {len(fixtures)} responses into {fixture_dir}")
+
+
+def synthesize(fixture_dir: Path, users: int, commits: int):
+    """
+    Generate fixtures with `users` contributors. They are spread over the different resolution
+    paths: noreply emails, the Rust team data, commit search, user search and no match at all.
+    """
+    import fetch_contributors
+
+    logins = [f"user{index}" for index in range(users)]
+    fixtures = {}
+    people = {}
+    identities = []
+    for index, login in enumerate(logins):
+        fixtures[fixture_key("GET", "api.github.com", f"/users/{login}", "")] = json_fixture(
+            {"login": login, "avatar_url": f"https://avatars.githubusercontent.com/u/{index}?v=4"},
+        )
+        fixtures[fixture_key("GET", "avatars.githubusercontent.com", f"/u/{index}", "v=4&s=256")] = make_fixture(
+            200, SYNTHETIC_AVATAR, {"Content-Type": "image/png"},
+        )
+        email = f"{login}@example.com"
+        kind = index % 5
+        if kind == 0:
+            email = f"{index}+{login}@users.noreply.github.com"
+        elif kind == 1:
+            people[login] = {"name": f"User {index}", "email": email, "github_id": index}
+        elif kind == 2:
+            item = {"author": {"login": login, "avatar_url": f"https://avatars.githubusercontent.com/u/{index}?v=4"}}
+            fixtures[fixture_key("GET", "api.github.com", "/search/commits",
+                                 urlencode({"q": f"author-email:{email}", "per_page": 1}))] = json_fixture(
+                {"total_count": 1, "items": [item]},
+            )
+        elif kind == 3:
+            item = {"login": login, "avatar_url": f"https://avatars.githubusercontent.com/u/{index}?v=4"}
+            fixtures[fixture_key("GET", "api.github.com", "/search/users",
+                                 urlencode({"q": f"{email} in:email", "per_page": 1}))] = json_fixture(
+                {"total_count": 1, "items": [item]},
+            )
+        # The remaining users cannot be resolved from their commits
+        identities.append((f"User {index}", email))
+    team_host, team_path = TEAM_API_PATH.split("/", 1)
+    fixtures[fixture_key("GET", team_host, f"/{team_path}", "")] = json_fixture({"people": people})
+
+    repo_count = len(fetch_contributors.REPOS)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for repo_index, (label, _) in enumerate(fetch_contributors.REPOS):
+            # Every third user shows up in the contributor list of a repo
+            contributors = [{"type": "User", "login": login,
+                             "avatar_url": f"https://avatars.githubusercontent.com/u/{index}?v=4"}
+                            for index, login in enumerate(logins) if index % 3 == 0 and index % repo_count == repo_index]
+            pages = [contributors[start:start + 100] for start in range(0, len(contributors), 100)] + [[]]
+            for page, data in enumerate(pages, start=1):
+                fixtures[fixture_key("GET", "api.github.com", f"/repos/{label}/contributors",
+                                     urlencode({"per_page": 100, "page": page, "anon": 0}))] = json_fixture(data)
+
+            source = Path(tmpdir) / label.replace("/", "_")
+            git("init", "--quiet", str(source))
+            stream = []
+            for commit in range(repo_index, commits, repo_count):
+                name, email = identities[commit % len(identities)]
+                stream += [
+                    "commit refs/heads/main",
+                    f"author {name} <{email}> {1500000000 + commit} +0000",
+                    f"committer {name} <{email}> {1500000000 + commit} +0000",
+                    f"data {len(str(commit))}",
+                    str(commit),
+                ]
+            git("-C", str(source), "fast-import", "--quiet", input="\n".join(stream) + "\n")
+            repo_path = fixture_dir / "repos" / f"{label.replace('/', '_')}.git"
+            if repo_path.exists():
+                shutil.rmtree(repo_path)
+            create_fixture_repo(repo_path, str(source))
+
+    (fixture_dir / "responses.json").write_text(json.dumps(fixtures, indent=1, sort_keys=True))
+    print(f"Generated {len(fixtures)} responses and {repo_count} repositories into {fixture_dir}")
+
+
+def directory_size(path: Path) -> int:
+    return sum(file.stat().st_size for file in path.rglob("*") if file.is_file()) if path.exists() else 0
+
+
+def use_work_dirs(fetch_contributors, work_dir: Path):
+    """Point all outputs and caches of the fetcher into `work_dir`."""
+    fetch_contributors.OUTPUT_DIR = work_dir / "contributors"
+    fetch_contributors.AVATARS_DIR = fetch_contributors.OUTPUT_DIR / "avatars"
+    fetch_contributors.USERNAMES_FILE = fetch_contributors.OUTPUT_DIR / "usernames.json"
+    fetch_contributors.CACHE_DIR = work_dir / "fetch-cache"
+    fetch_contributors.HTTP_CACHE_DIR = fetch_contributors.CACHE_DIR / "http"
+    fetch_contributors.MIRRORS_DIR = fetch_contributors.CACHE_DIR / "repos"
+    fetch_contributors.SCAN_STATE_FILE = fetch_contributors.CACHE_DIR / "scanned.json"
+    fetch_contributors.RESOLUTIONS_FILE = fetch_contributors.CACHE_DIR / "resolutions.json"
+
+
+def instrument_stages(fetch_contributors) -> dict[str, list[float]]:
+    """Wrap the stage functions of the fetcher, returns stage -> [first start, last end]."""
+    spans = {}
+    lock = threading.Lock()
+
+    def timed(stage: str, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                end = time.time()
+                with lock:
+                    span = spans.setdefault(stage, [start, end])
+                    span[0] = min(span[0], start)
+                    span[1] = max(span[1], end)
+
+        return wrapper
+
+    fetch_contributors.fetch_rust_team_people = timed("team", fetch_contributors.fetch_rust_team_people)
+    fetch_contributors.fetch_github_contributors = timed("contributors", fetch_contributors.fetch_github_contributors)
+    fetch_contributors.collect_commit_emails_and_names = timed("scanning",
+                                                               fetch_contributors.collect_commit_emails_and_names)
+    fetch_contributors.IdentityResolver.resolve = timed("resolution", fetch_contributors.IdentityResolver.resolve)
+    fetch_contributors.download_avatar = timed("avatars", fetch_contributors.download_avatar)
+    return spans
+
+
+def bench(fixture_dir: Path, latency: float, runs: int, core_limit: int, search_limit: int, window: float,
+          graphql: bool):
+    fixtures = json.loads((fixture_dir / "responses.json").read_text())
+    limits = {"core": (core_limit, window), "search": (search_limit, window), "graphql": (core_limit, window)}
+    server = FixtureServer(fixtures, latency, limits)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # The fetcher reads its endpoints when it is imported
+    os.environ["GITHUB_API_URL"] = f"{server.base_url}/api.github.com"
+    os.environ["RUST_TEAM_API_URL"] = f"{server.base_url}/{TEAM_API_PATH}"
+    os.environ["GITHUB_TOKEN"] = "offline-benchmark" if graphql else ""
+    import fetch_contributors
+
+    # Pace the fetcher with the same budgets that the server enforces
+    fetch_contributors.CORE_LIMITER = fetch_contributors.RateLimiter("core", core_limit, window)
+    fetch_contributors.SEARCH_LIMITER = fetch_contributors.RateLimiter("search", search_limit, window)
+    fetch_contributors.GRAPHQL_LIMITER = fetch_contributors.RateLimiter("graphql", core_limit, window)
+    fetch_contributors.REPOS = [
+        (label, (fixture_dir / "repos" / f"{label.replace('/', '_')}.git").resolve().as_uri())
+        for label, _ in fetch_contributors.REPOS
+    ]
+    spans = instrument_stages(fetch_contributors)
+
+    git_transfers = [0]
+    original_git = fetch_contributors.git
+
+    def counting_git(*args: str) -> str:
+        if "clone" in args or "fetch" in args:
+            git_transfers[0] += 1
+        return original_git(*args)
+
+    fetch_contributors.git = counting_git
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        use_work_dirs(fetch_contributors, Path(tmpdir))
+        for run in range(runs):
+            spans.clear()
+            server.stats.clear()
+            mirrors_size = directory_size(fetch_contributors.MIRRORS_DIR)
+            start = time.time()
+            fetch_contributors.main()
+            total = time.time() - start
+
+            stats = {stage: dict(stage_stats) for stage, stage_stats in server.stats.items()}
+            # Git talks to the fixture repositories directly, count the clones/fetches and the
+            # growth of the mirrors instead
+            stats["scanning"] = {"requests": git_transfers[0],
+                                 "bytes": directory_size(fetch_contributors.MIRRORS_DIR) - mirrors_size}
+            git_transfers[0] = 0
+            results.append((total, dict(spans), stats))
+    server.shutdown()
+
+    for run, (total, run_spans, stats) in enumerate(results, start=1):
+        print(f"\nRun {run}: {total:.2f}s")
+        print(f"  {'stage':<14}{'time':>10}{'requests':>10}{'bytes':>12}")
+        for stage in STAGES:
+            span = run_spans.get(stage)
+            duration = f"{span[1] - span[0]:.2f}s" if span else "-"
+            stage_stats = stats.get(stage, {"requests": 0, "bytes": 0})
+            print(f"  {stage:<14}{duration:>10}{stage_stats['requests']:>10}{stage_stats['bytes']:>12}")
+    if server.missing:
+        print(f"\n{len(server.missing)} distinct request(s) had no recorded response and were answered with 404, "
+              f"e.g. {sorted(server.missing)[0]}")
+    # The fetcher paces itself with the same budgets, so the server must never have to reject a request
+    if server.rate_limited:
+        sys.exit(f"\nError: {server.rate_limited} request(s) were rejected by the rate limits")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record", help="record fixtures from the real services")
+    record_parser.add_argument("fixtures", type=Path)
+
+    synthesize_parser = subparsers.add_parser("synthesize", help="generate synthetic fixtures")
+    synthesize_parser.add_argument("fixtures", type=Path)
+    synthesize_parser.add_argument("--users", type=int, default=300)
+    synthesize_parser.add_argument("--commits", type=int, default=5000)
+
+    bench_parser = subparsers.add_parser("bench", help="run the fetcher against the fixtures")
+    bench_parser.add_argument("fixtures", type=Path)
+    bench_parser.add_argument("--latency", type=float, default=0.05, help="latency of each response in seconds")
+    bench_parser.add_argument("--runs", type=int, default=2, help="number of runs sharing the caches")
+    bench_parser.add_argument("--core-limit", type=int, default=5000, help="core requests per window")
+    bench_parser.add_argument("--search-limit", type=int, default=30, help="search requests per window")
+    bench_parser.add_argument("--window", type=float, default=60, help="rate limit window in seconds")
+    bench_parser.add_argument("--graphql", action="store_true", help="look up users through GraphQL")
+
+    args = parser.parse_args()
+    if args.command == "record":
+        record(args.fixtures)
+    elif args.command == "synthesize":
+        synthesize(args.fixtures, args.users, args.commits)
+    else:
+        bench(args.fixtures, args.latency, args.runs, args.core_limit, args.search_limit, args.window,
+              args.graphql)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).parent))
+    main()
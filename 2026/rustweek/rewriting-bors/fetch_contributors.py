@@ -4,14 +4,21 @@ Fetch all unique contributors from barosl/homu, rust-lang/homu, and rust-lang/bo
 repositories. Download their GitHub usernames and avatar images.
 """
 
+import dataclasses
+import hashlib
 import json
 import os
-import tempfile
+import subprocess
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Callable, TypeVar
 
-import git
 import requests
+from requests.adapters import HTTPAdapter
+
+from identities import IdentityResolver
 
 REPOS = [
     ("graydon/bors", "https://github.com/graydon/bors.git"),
@@ -25,10 +32,47 @@ OUTPUT_DIR = Path(__file__).parent / "contributors"
 AVATARS_DIR = OUTPUT_DIR / "avatars"
 USERNAMES_FILE = OUTPUT_DIR / "usernames.json"
 
-GITHUB_API = "https://api.github.com"
-RUST_TEAM_API = "https://team-api.infra.rust-lang.org/v1/people.json"
+CACHE_DIR = Path(__file__).parent / "fetch-cache"
+HTTP_CACHE_DIR = CACHE_DIR / "http"
+MIRRORS_DIR = CACHE_DIR / "repos"
+SCAN_STATE_FILE = CACHE_DIR / "scanned.json"
+RESOLUTIONS_FILE = CACHE_DIR / "resolutions.json"
+# How long (in seconds) are "not found" answers reused without asking GitHub again
+NEGATIVE_TTL = int(os.environ.get("FETCH_NEGATIVE_TTL", str(7 * 24 * 3600)))
+
+GITHUB_API = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+GRAPHQL_API = f"{GITHUB_API}/graphql"
+# Number of users looked up by a single GraphQL query
+GRAPHQL_BATCH_SIZE = 100
+RUST_TEAM_API = os.environ.get("RUST_TEAM_API_URL", "https://team-api.infra.rust-lang.org/v1/people.json")
 TOKEN = os.environ.get("GITHUB_TOKEN", "")
 
+# Maximum number of requests in flight at once
+CONCURRENCY = int(os.environ.get("FETCH_CONCURRENCY", "16"))
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def create_session() -> requests.Session:
+    """Create a session that keeps enough connections alive for all concurrent requests."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=CONCURRENCY)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+SESSION = create_session()
+
+
+def map_concurrently(fn: Callable[[T], R], items: list[T]) -> list[R]:
+    """Call `fn` for all items with at most CONCURRENCY calls in flight, keeping the order of results."""
+    if not items:
+        return []
+    with ThreadPoolExecutor(min(CONCURRENCY, len(items))) as pool:
+        return list(pool.map(fn, items))
+
 
 def get_headers():
     headers = {"Accept": "application/vnd.github.v3+json"}
@@ -37,26 +81,170 @@ def get_headers():
     return headers
 
 
+class RateLimiter:
+    """
+    Budget of one GitHub rate limit resource (core or search). Requests take a token before they
+    are sent and wait for the next window when the budget is exhausted, so that GitHub never has
+    to answer with a 403. The budget is synchronized from the X-RateLimit-* headers of responses.
+    """
+
+    def __init__(self, name: str, limit: int, period: float):
+        self.name = name
+        self.limit = limit
+        self.period = period
+        self.remaining = limit
+        self.reset_at = time.time() + period
+        # Whether `reset_at` comes from the server or is only a local estimate
+        self.synced = False
+        # Lowest remaining budget reported by the server in the current window
+        self.server_remaining = limit
+        self.in_flight = 0
+        self.announced_reset = None
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                now = time.time()
+                if now >= self.reset_at:
+                    self.remaining = self.limit
+                    self.server_remaining = self.limit
+                    self.reset_at = now + self.period
+                    self.synced = False
+                if self.remaining > 0:
+                    self.remaining -= 1
+                    self.in_flight += 1
+                    return
+                wait = self.reset_at - now
+                if self.announced_reset != self.reset_at:
+                    self.announced_reset = self.reset_at
+                    print(f"  {self.name} rate limit budget exhausted, waiting {wait:.0f}s...")
+                self.condition.wait(wait)
+
+    def release(self, headers=None):
+        """Finish a request taken by `acquire`, with the headers of its response if there is one."""
+        with self.condition:
+            self.in_flight -= 1
+            remaining = headers.get("X-RateLimit-Remaining") if headers is not None else None
+            reset_at = headers.get("X-RateLimit-Reset") if headers is not None else None
+            if remaining is not None and reset_at is not None:
+                self._sync(int(remaining), float(reset_at))
+            self.condition.notify_all()
+
+    def _sync(self, remaining: int, reset_at: float):
+        if reset_at <= time.time():
+            # A response from a window that has already ended
+            return
+        if not self.synced or reset_at > self.reset_at + 1:
+            # The first response of a window (the server window may differ from the local estimate)
+            self.reset_at = reset_at
+            self.server_remaining = remaining
+            self.synced = True
+        elif reset_at < self.reset_at - 1:
+            # A stale response from a previous window, the reset time never moves backwards
+            return
+        else:
+            # The server budget only decreases within a window, responses can arrive out of order.
+            # Conditional requests answered with 304 do not count, so the server budget is the truth,
+            # minus the requests that are still in flight.
+            self.server_remaining = min(self.server_remaining, remaining)
+        self.remaining = max(0, self.server_remaining - self.in_flight)
+
+
+# Unauthenticated requests have much lower limits
+CORE_LIMITER = RateLimiter("core", 5000 if TOKEN else 60, 3600)
+SEARCH_LIMITER = RateLimiter("search", 30 if TOKEN else 10, 60)
+GRAPHQL_LIMITER = RateLimiter("graphql", 5000, 3600)
+
+
+def github_request(method: str, url: str, **kwargs) -> requests.Response:
+    """Send a request, paced by the rate limit budget of the requested GitHub API resource."""
+    limiter = None
+    if url.startswith(GRAPHQL_API):
+        limiter = GRAPHQL_LIMITER
+    elif url.startswith(f"{GITHUB_API}/search/"):
+        limiter = SEARCH_LIMITER
+    elif url.startswith(GITHUB_API):
+        limiter = CORE_LIMITER
+    if limiter is None:
+        return SESSION.request(method, url, timeout=30, **kwargs)
+    limiter.acquire()
+    resp = None
+    try:
+        resp = SESSION.request(method, url, timeout=30, **kwargs)
+    finally:
+        limiter.release(resp.headers if resp is not None else None)
+    return resp
+
+
+@dataclasses.dataclass
+class CachedResponse:
+    status_code: int
+    text: str
+    headers: dict
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def http_cache_path(url: str, params: dict | None, headers: dict | None) -> Path:
+    key = json.dumps([url, params or {}, (headers or {}).get("Accept")], sort_keys=True)
+    return HTTP_CACHE_DIR / f"{hashlib.sha1(key.encode()).hexdigest()}.json"
+
+
+def is_negative(entry: dict) -> bool:
+    """Not found users and searches without any results."""
+    if entry["status_code"] == 404:
+        return True
+    if entry["status_code"] != 200:
+        return False
+    body = json.loads(entry["text"])
+    return isinstance(body, dict) and body.get("total_count") == 0
+
+
+def cached_get(url: str, params: dict | None = None, headers: dict | None = None) -> CachedResponse:
+    """
+    GET request backed by an on-disk cache. Cached bodies are revalidated with their
+    ETag/Last-Modified (a 304 does not count against the rate limit), negative answers are
+    reused without any request until NEGATIVE_TTL expires.
+    """
+    path = http_cache_path(url, params, headers)
+    entry = json.loads(path.read_text()) if path.exists() else None
+    if entry and is_negative(entry) and time.time() - entry["fetched_at"] < NEGATIVE_TTL:
+        return CachedResponse(entry["status_code"], entry["text"], {})
+
+    headers = dict(headers or {})
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    resp = github_request("GET", url, params=params, headers=headers)
+    if resp.status_code == 304 and entry:
+        return CachedResponse(entry["status_code"], entry["text"], dict(resp.headers))
+
+    if resp.status_code in (200, 404):
+        entry = {
+            "status_code": resp.status_code,
+            "text": resp.text,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "fetched_at": time.time(),
+        }
+        HTTP_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp_path.write_text(json.dumps(entry))
+        tmp_path.replace(path)
+    return CachedResponse(resp.status_code, resp.text, dict(resp.headers))
+
+
 def fetch_rust_team_people() -> dict:
-    """Fetch the Rust team people database. Returns {email -> {login, github_id}} and {name_lower -> {login, github_id}}."""
+    """Fetch the Rust team people database. Returns {login -> {name, email, github_id, ...}}."""
     print("Fetching Rust team API data...")
-    resp = requests.get(RUST_TEAM_API, timeout=30)
+    resp = SESSION.get(RUST_TEAM_API, timeout=30)
     resp.raise_for_status()
     people = resp.json().get("people", {})
-
-    by_email = {}
-    by_name = {}
-    for github_login, info in people.items():
-        entry = {"login": github_login, "github_id": info.get("github_id")}
-        email = info.get("email")
-        if email:
-            by_email[email.lower()] = entry
-        name = info.get("name")
-        if name:
-            by_name[name.lower()] = entry
-
-    print(f"  Loaded {len(people)} people ({len(by_email)} with emails)")
-    return by_email, by_name
+    print(f"  Loaded {len(people)} people ({sum(1 for info in people.values() if info.get('email'))} with emails)")
+    return people
 
 
 def fetch_github_contributors(owner_repo: str) -> dict:
@@ -64,7 +252,7 @@ def fetch_github_contributors(owner_repo: str) -> dict:
     contributors = {}
     page = 1
     while True:
-        resp = requests.get(
+        resp = github_api_with_retry(
             f"{GITHUB_API}/repos/{owner_repo}/contributors",
             params={"per_page": 100, "page": page, "anon": 0},
             headers=get_headers(),
@@ -82,25 +270,74 @@ def fetch_github_contributors(owner_repo: str) -> dict:
     return contributors
 
 
-def collect_commit_emails_and_names(repo_url: str, tmpdir: str, label: str) -> set[tuple[str, str]]:
-    """Clone a repo and collect all unique (name, email) pairs from commits."""
-    print(f"Cloning {label}...")
-    repo_path = os.path.join(tmpdir, label.replace("/", "_"))
-    repo = git.Repo.clone_from(repo_url, repo_path)
+def git(*args: str) -> str:
+    return subprocess.run(["git", *args], check=True, capture_output=True, text=True).stdout
+
+
+def update_mirror(repo_url: str, label: str) -> Path:
+    """Keep a bare blobless mirror of the repository branches and tags, fetching only new objects."""
+    path = MIRRORS_DIR / f"{label.replace('/', '_')}.git"
+    if not path.exists():
+        print(f"Cloning {label}...")
+        MIRRORS_DIR.mkdir(parents=True, exist_ok=True)
+        git("clone", "--bare", "--filter=blob:none", repo_url, str(path))
+        git("-C", str(path), "config", "remote.origin.fetch", "+refs/heads/*:refs/heads/*")
+    else:
+        print(f"Fetching {label}...")
+    git("-C", str(path), "fetch", "--prune", "--tags", "origin")
+    return path
 
+
+def scan_commit_identities(repo_path: Path, exclude: list[str]) -> set[tuple[str, str]]:
+    """Stream author and committer identities of all commits not reachable from `exclude`."""
+    process = subprocess.Popen(
+        ["git", "-C", str(repo_path), "log", "--all", "--format=%an%x00%ae%x00%cn%x00%ce",
+         *[f"^{sha}" for sha in exclude]],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, errors="replace",
+    )
     contributors = set()
-    for commit in repo.iter_commits("--all"):
-        contributors.add((commit.author.name, commit.author.email))
-        contributors.add((commit.committer.name, commit.committer.email))
+    for line in process.stdout:
+        author_name, author_email, committer_name, committer_email = line.rstrip("\n").split("\0")
+        contributors.add((author_name, author_email))
+        contributors.add((committer_name, committer_email))
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, "git log")
+    return contributors
 
+
+def collect_commit_emails_and_names(repo_url: str, label: str, state: dict) -> set[tuple[str, str]]:
+    """
+    Collect all unique (name, email) pairs from commits of a repo.
+    Only commits added since the previous run are scanned, `state` remembers the scanned
+    ref tips and the identities found so far.
+    """
+    repo_path = update_mirror(repo_url, label)
+    previous = state.get(label, {"tips": [], "identities": []})
+    contributors = {tuple(identity) for identity in previous["identities"]}
+    try:
+        new_contributors = scan_commit_identities(repo_path, previous["tips"])
+    except subprocess.CalledProcessError:
+        # Some previously scanned commit is gone (e.g. after a force-push), scan everything
+        contributors = set()
+        new_contributors = scan_commit_identities(repo_path, [])
+    contributors.update(new_contributors)
+
+    state[label] = {
+        "tips": git("-C", str(repo_path), "for-each-ref", "--format=%(objectname)").split(),
+        "identities": sorted(contributors),
+    }
     print(f"  Found {len(contributors)} unique (name, email) pairs in {label}")
     return contributors
 
 
 def github_api_with_retry(url, params=None, headers=None, max_retries=3):
-    """Make a GitHub API request with rate limit handling."""
+    """
+    Make a GitHub API request with rate limit handling. Requests are already paced by the
+    rate limiters, this only handles limits that were not visible in the response headers
+    (e.g. the secondary rate limits).
+    """
     for attempt in range(max_retries):
-        resp = requests.get(url, params=params, headers=headers, timeout=30)
+        resp = cached_get(url, params=params, headers=headers)
         if resp.status_code == 403 and "rate limit" in resp.text.lower():
             reset_time = int(resp.headers.get("X-RateLimit-Reset", 0))
             wait = max(reset_time - int(time.time()), 5)
@@ -112,19 +349,7 @@ def github_api_with_retry(url, params=None, headers=None, max_retries=3):
 
 
 def resolve_github_username(email: str, name: str) -> dict | None:
-    """Try to resolve a GitHub username from a commit email via the GitHub API."""
-    # Handle GitHub noreply emails
-    if email.endswith("@users.noreply.github.com"):
-        username = email.split("@")[0]
-        # Handle numeric prefix format: 12345+username or username+12345
-        if "+" in username:
-            parts = username.split("+")
-            for p in parts:
-                if not p.isdigit():
-                    username = p
-                    break
-        return lookup_user(username)
-
+    """Try to resolve a GitHub username from a commit email via the GitHub search API."""
     # Search commits by email
     resp = github_api_with_retry(
         f"{GITHUB_API}/search/commits",
@@ -155,29 +380,56 @@ def resolve_github_username(email: str, name: str) -> dict | None:
 
 def lookup_user(username: str) -> dict | None:
     """Look up a GitHub user by username."""
-    resp = requests.get(f"{GITHUB_API}/users/{username}", headers=get_headers(), timeout=30)
+    resp = github_api_with_retry(f"{GITHUB_API}/users/{username}", headers=get_headers())
     if resp.status_code == 200:
         data = resp.json()
         return {"login": data["login"], "avatar_url": data["avatar_url"]}
     return None
 
 
-def resolve_from_rust_team(email: str, name: str, by_email: dict, by_name: dict) -> str | None:
-    """Try to resolve a GitHub username from the Rust team API data."""
-    print(f"Resolving {email}/{name} from team")
-    # Try email match first
-    result = by_email.get(email.lower())
-    if result:
-        print(f"Found login {result}")
-        return result["login"]
+def lookup_users_graphql(logins: list[str]) -> dict[str, dict | None]:
+    """
+    Look up users with a single GraphQL query, using one aliased `user` field per login.
+    Returns {login -> {login, avatar_url} or None}.
+    """
+    fields = " ".join(f"u{index}: user(login: {json.dumps(login)}) {{ login avatarUrl }}"
+                      for index, login in enumerate(logins))
+    resp = github_request("POST", GRAPHQL_API, json={"query": f"query {{ {fields} }}"}, headers=get_headers())
+    resp.raise_for_status()
+    data = resp.json().get("data")
+    if data is None:
+        raise Exception(f"GraphQL query failed: {resp.text}")
+
+    users = {}
+    for index, login in enumerate(logins):
+        user = data.get(f"u{index}")
+        users[login] = {"login": user["login"], "avatar_url": user["avatarUrl"]} if user else None
+    return users
+
+
+def lookup_users(logins: list[str]) -> dict[str, dict | None]:
+    """
+    Look up users in batches of GRAPHQL_BATCH_SIZE logins per GraphQL query. The GraphQL API
+    requires a token, without it (or when a batch fails) the users are looked up one by one
+    through the REST API.
+    """
+    def lookup_batch(batch: list[str]) -> dict[str, dict | None]:
+        try:
+            return lookup_users_graphql(batch)
+        except Exception as error:
+            print(f"  GraphQL lookup failed ({error}), falling back to REST")
+            return {}
+
+    users = {}
+    if TOKEN:
+        batches = [logins[start:start + GRAPHQL_BATCH_SIZE] for start in range(0, len(logins), GRAPHQL_BATCH_SIZE)]
+        for batch_users in map_concurrently(lookup_batch, batches):
+            users.update(batch_users)
 
-    # Try name match
-    result = by_name.get(name.lower())
-    if result:
-        print(f"Found login {result}")
-        return result["login"]
-
-    return None
+    # Logins that GraphQL did not resolve go through REST in one flat pool, not a pool per batch
+    fallback = [login for login in logins if login not in users]
+    users.update(zip(fallback, map_concurrently(lookup_user, fallback)))
+    return {login: users[login] for login in logins}
 
 
 def download_avatar(login: str, avatar_url: str, output_dir: Path):
@@ -187,7 +439,7 @@ def download_avatar(login: str, avatar_url: str, output_dir: Path):
         print(f"  Avatar for {login} already exists, skipping")
         return
     url = avatar_url + ("&" if "?" in avatar_url else "?") + "s=256"
-    resp = requests.get(url, timeout=30)
+    resp = SESSION.get(url, timeout=30)
     if resp.status_code == 200:
         filepath.write_bytes(resp.content)
         print(f"  Saved avatar for {login}")
@@ -200,83 +452,35 @@ def main():
     AVATARS_DIR.mkdir(parents=True, exist_ok=True)
 
     # Step 1: Fetch Rust team API data for fallback resolution
-    rust_by_email, rust_by_name = fetch_rust_team_people()
+    resolver = IdentityResolver(RESOLUTIONS_FILE, fetch_rust_team_people())
 
     # Step 2: Fetch contributors via GitHub API (efficient, no rate limit issues)
-    resolved = {}  # login -> avatar_url
-    for label, _ in REPOS:
-        print(f"Fetching GitHub contributors for {label}...")
-        api_contributors = fetch_github_contributors(label)
-        resolved.update(api_contributors)
-        print(f"  Found {len(api_contributors)} contributors via API")
+    labels = [label for label, _ in REPOS]
+    for label, api_contributors in zip(labels, map_concurrently(fetch_github_contributors, labels)):
+        for login, avatar_url in api_contributors.items():
+            resolver.add_user(login, avatar_url)
+        print(f"Found {len(api_contributors)} contributors of {label} via API")
 
-    print(f"\nTotal from GitHub API: {len(resolved)} unique contributors")
+    print(f"\nTotal from GitHub API: {len(resolver.avatars)} unique contributors")
 
-    # Step 3: Clone repos and collect commit emails to find any missed contributors
+    # Step 3: Update repo mirrors and collect commit emails to find any missed contributors
+    scan_state = json.loads(SCAN_STATE_FILE.read_text()) if SCAN_STATE_FILE.exists() else {}
     all_contributors = set()
-    with tempfile.TemporaryDirectory() as tmpdir:
-        for label, url in REPOS:
-            contributors = collect_commit_emails_and_names(url, tmpdir, label)
-            all_contributors.update(contributors)
+    for contributors in map_concurrently(
+            lambda repo: collect_commit_emails_and_names(repo[1], repo[0], scan_state), REPOS):
+        all_contributors.update(contributors)
+    SCAN_STATE_FILE.write_text(json.dumps(scan_state, indent=2) + "\n")
 
     print(f"\nTotal unique (name, email) pairs across all repos: {len(all_contributors)}")
 
     # Step 4: Try to resolve remaining contributors not found via the API
-    seen_emails = set()
-    unresolved = []
-
-    for name, email in sorted(all_contributors):
-        if email in seen_emails:
-            continue
-        seen_emails.add(email)
-
-        # Skip known bot/noreply
-        if email == "noreply@github.com":
-            continue
-        if "[bot]" in email or "[bot]" in name:
-            continue
-
-        # Check if already resolved
-        # For noreply emails, extract username and check
-        if email.endswith("@users.noreply.github.com"):
-            username = email.split("@")[0]
-            if "+" in username:
-                parts = username.split("+")
-                for p in parts:
-                    if not p.isdigit():
-                        username = p
-                        break
-            if username.lower() in {k.lower() for k in resolved}:
-                continue
-
-        # Try Rust team API first (no rate limits)
-        rust_login = resolve_from_rust_team(email, name, rust_by_email, rust_by_name)
-        if rust_login:
-            if rust_login not in resolved:
-                print(f"Resolved {name} <{email}> -> {rust_login} (via Rust team API)")
-                user_info = lookup_user(rust_login)
-                if user_info:
-                    resolved[user_info["login"]] = user_info["avatar_url"]
-                else:
-                    # Construct avatar URL from github_id if available
-                    entry = rust_by_email.get(email.lower()) or rust_by_name.get(name.lower())
-                    if entry and entry.get("github_id"):
-                        resolved[rust_login] = f"https://avatars.githubusercontent.com/u/{entry['github_id']}"
-            continue
-
-        # Try GitHub API search
-        print(f"Resolving {name} <{email}> via GitHub API...")
-        result = resolve_github_username(email, name)
-        if result:
-            login = result["login"]
-            if login not in resolved:
-                resolved[login] = result["avatar_url"]
-                print(f"  -> {login}")
-            else:
-                print(f"  -> {login} (already known)")
-        else:
-            unresolved.append((name, email))
-            print(f"  -> Could not resolve")
+    unresolved = resolver.resolve(
+        all_contributors,
+        lookup_users=lookup_users,
+        search_identities=lambda identities: map_concurrently(
+            lambda identity: resolve_github_username(identity[1], identity[0]), identities),
+    )
+    resolved = resolver.avatars  # login -> avatar_url
 
     print(f"\nResolved {len(resolved)} unique GitHub users")
     if unresolved:
@@ -291,9 +495,7 @@ def main():
 
     # Step 6: Download avatars
     print("\nDownloading avatars...")
-    for login in usernames:
-        avatar_url = resolved[login]
-        download_avatar(login, avatar_url, AVATARS_DIR)
+    map_concurrently(lambda login: download_avatar(login, resolved[login], AVATARS_DIR), usernames)
 
     print(f"\nDone! {len(usernames)} contributors found.")
 
@@ -0,0 +1,139 @@
+"""
+Resolution of commit identities (name, email) to GitHub logins.
+"""
+
+import json
+from pathlib import Path
+from typing import Callable
+
+NOREPLY_SUFFIX = "@users.noreply.github.com"
+
+# Look up GitHub users by their login, returns {login -> {login, avatar_url} or None}
+LookupUsers = Callable[[list[str]], dict[str, dict | None]]
+# Search GitHub users by commit identities, returns [{login, avatar_url} or None]
+SearchIdentities = Callable[[list[tuple[str, str]]], list[dict | None]]
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(name.casefold().split())
+
+
+def noreply_login(email: str) -> str | None:
+    """Extract the login from a GitHub noreply email (login@, 12345+login@ or login+12345@)."""
+    if not email.casefold().endswith(NOREPLY_SUFFIX):
+        return None
+    username = email.split("@")[0]
+    if "+" in username:
+        for part in username.split("+"):
+            if not part.isdigit():
+                return part
+    return username
+
+
+def is_bot(name: str, email: str) -> bool:
+    return email == "noreply@github.com" or "[bot]" in email or "[bot]" in name
+
+
+class IdentityResolver:
+    """
+    Resolves commit identities in batch phases. First all identities go through the local
+    indexes (known logins, noreply emails, resolutions from previous runs and the Rust team
+    data), then the remaining logins and identities are looked up remotely, each only once.
+    Resolutions are persisted in `table_path`, so later runs do not have to search again.
+    """
+
+    def __init__(self, table_path: Path, team_people: dict):
+        self.table_path = table_path
+        # email -> {login, avatar_url}
+        self.table: dict[str, dict] = json.loads(table_path.read_text()) if table_path.exists() else {}
+
+        self.team_by_email = {}
+        self.team_by_name = {}
+        for login, info in team_people.items():
+            entry = {"login": login, "github_id": info.get("github_id")}
+            if info.get("email"):
+                self.team_by_email[info["email"].casefold()] = entry
+            if info.get("name"):
+                self.team_by_name[normalize_name(info["name"])] = entry
+
+        # casefolded login -> login
+        self.logins: dict[str, str] = {}
+        # login -> avatar_url
+        self.avatars: dict[str, str] = {}
+
+    def add_user(self, login: str, avatar_url: str):
+        if login.casefold() not in self.logins:
+            self.logins[login.casefold()] = login
+            self.avatars[login] = avatar_url
+
+    def is_known(self, login: str) -> bool:
+        return login.casefold() in self.logins
+
+    def remember(self, email_key: str, login: str):
+        login = self.logins[login.casefold()]
+        self.table[email_key] = {"login": login, "avatar_url": self.avatars[login]}
+
+    def resolve(self, identities: set[tuple[str, str]], lookup_users: LookupUsers,
+                search_identities: SearchIdentities) -> list[tuple[str, str]]:
+        """Resolve (name, email) identities to users, returns the identities that could not be resolved."""
+        # Phase 1: local lookups, one identity per email
+        identities_by_email = {}
+        for name, email in sorted(identities):
+            if is_bot(name, email):
+                continue
+            identities_by_email.setdefault(email.casefold(), (name, email))
+
+        email_logins = {}  # email -> login
+        pending_logins = {}  # casefolded login -> (login, fallback avatar_url)
+        to_search = []
+        for email_key, (name, email) in identities_by_email.items():
+            known = self.table.get(email_key)
+            if known:
+                self.add_user(known["login"], known["avatar_url"])
+                email_logins[email_key] = known["login"]
+                continue
+
+            login = noreply_login(email)
+            fallback_avatar = None
+            if login is None:
+                entry = self.team_by_email.get(email_key) or self.team_by_name.get(normalize_name(name))
+                if entry:
+                    login = entry["login"]
+                    if entry.get("github_id"):
+                        fallback_avatar = f"https://avatars.githubusercontent.com/u/{entry['github_id']}"
+            if login is None:
+                to_search.append((name, email))
+                continue
+            email_logins[email_key] = login
+            if not self.is_known(login):
+                pending_logins.setdefault(login.casefold(), (login, fallback_avatar))
+
+        # Phase 2: deduplicated remote lookups
+        unresolved = []
+        print(f"Looking up {len(pending_logins)} logins...")
+        users = lookup_users([login for login, _ in pending_logins.values()])
+        for login, fallback_avatar in pending_logins.values():
+            user = users.get(login)
+            if user:
+                self.add_user(user["login"], user["avatar_url"])
+            elif fallback_avatar:
+                self.add_user(login, fallback_avatar)
+        for email_key, login in email_logins.items():
+            if self.is_known(login):
+                self.remember(email_key, login)
+            else:
+                to_search.append(identities_by_email[email_key])
+
+        print(f"Searching {len(to_search)} identities...")
+        for (name, email), user in zip(to_search, search_identities(to_search)):
+            if user:
+                self.add_user(user["login"], user["avatar_url"])
+                self.remember(email.casefold(), user["login"])
+                print(f"  {name} <{email}> -> {user['login']}")
+            else:
+                unresolved.append((name, email))
+                print(f"  {name} <{email}> -> Could not resolve")
+
+        self.table_path.parent.mkdir(parents=True, exist_ok=True)
+        self.table_path.write_text(json.dumps(dict(sorted(self.table.items())), indent=2) + "\n")
+        return unresolved
@@ -0,0 +1,332 @@
+import hashlib
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+from typing import Callable, List, Optional, Tuple, TypeVar
+
+from elsie import SlideDeck
+from elsie.boxtree.box import Box
+from elsie.render.backends import Backend, InkscapeBackend
+from elsie.render.inkscape import InkscapeShell, export_by_inkscape
+from elsie.render.pdfmerge import PyPdfMerger
+from elsie.version import VERSION
+
+# (slide PDF path, [(step SVG, step PDF path)])
+SlideJob = Tuple[str, List[Tuple[str, str]]]
+
+R = TypeVar("R")
+
+WORKER_INKSCAPE: Optional[InkscapeShell] = None
+
+
+class InkscapePool:
+    """
+    A pool of warm Inkscape shells with the interface of `InkscapeShell` that `InkscapeBackend`
+    uses, see `make_backend`. Layout queries go to the first shell, `convert_many` spreads batches
+    of conversions over all shells. Shells are started lazily and restarted when they crash.
+    """
+
+    def __init__(self, inkscape_factory: Callable[[], InkscapeShell], size: int,
+                 batch_size: int = 8, attempts: int = 3):
+        self.inkscape_factory = inkscape_factory
+        self.batch_size = batch_size
+        self.attempts = attempts
+        self.shells: List[Optional[InkscapeShell]] = [None] * size
+        self.text_to_path = getattr(self.shell(0), "text_to_path", False)
+
+    def shell(self, index: int) -> InkscapeShell:
+        if self.shells[index] is None:
+            self.shells[index] = self.inkscape_factory()
+        return self.shells[index]
+
+    def run_with_restart(self, index: int, fn: Callable[[InkscapeShell], R]) -> R:
+        """Runs `fn` with the shell at `index`, restarting the shell and retrying when it fails."""
+        for attempt in range(self.attempts):
+            try:
+                return fn(self.shell(index))
+            except Exception:
+                # The shell is in an unknown state, start a fresh one for the next attempt
+                shell = self.shells[index]
+                if shell is not None:
+                    shell.process.kill()
+                    self.shells[index] = None
+                if attempt == self.attempts - 1:
+                    raise
+
+    def run_command(self, command: str) -> str:
+        return self.run_with_restart(0, lambda shell: run_command_checked(shell, command))
+
+    def get_version(self) -> str:
+        return self.run_command("inkscape-version")
+
+    def get_width(self, svg: str, id: str) -> float:
+        return self.run_query(svg, "query-width", id)
+
+    def get_height(self, svg: str, id: str) -> float:
+        return self.run_query(svg, "query-height", id)
+
+    def get_x(self, svg: str, id: str) -> float:
+        return self.run_query(svg, "query-x", id)
+
+    def run_query(self, svg: str, query: str, id: str) -> float:
+        def query_shell(shell: InkscapeShell) -> str:
+            with tempfile.NamedTemporaryFile("w", suffix=".svg") as file:
+                file.write(svg)
+                file.flush()
+                run_command_checked(shell, f"file-open:{file.name}")
+                try:
+                    run_command_checked(shell, f"select:{id}")
+                    return run_command_checked(shell, query)
+                finally:
+                    run_command_checked(shell, "file-close")
+
+        value = self.run_with_restart(0, query_shell)
+        try:
+            return float(value)
+        except ValueError:
+            raise Exception(f"Inkscape query executed ({query}) and should return "
+                            f"float but returned {repr(value)}")
+
+    def convert_to_pdf(self, source, target: str, type: str):
+        self.convert_many([(source, target)], type)
+
+    def close(self):
+        for shell in self.shells:
+            if shell is not None:
+                shell.close()
+
+    def convert_many(self, items: List[Tuple[bytes, str]], type: str = "pdf"):
+        """Converts (SVG, target path) pairs, each idle shell takes the next pending batch."""
+        batches = queue.Queue()
+        for start in range(0, len(items), self.batch_size):
+            batches.put(items[start:start + self.batch_size])
+
+        errors = []
+
+        def worker(index: int):
+            while True:
+                try:
+                    batch = batches.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    self._convert_batch(index, batch, type)
+                except BaseException as error:
+                    errors.append(error)
+                    return
+
+        shell_count = min(len(self.shells), batches.qsize())
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(shell_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def _convert_batch(self, index: int, batch: List[Tuple[bytes, str]], type: str):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            actions = []
+            for (i, (svg, target)) in enumerate(batch):
+                source = os.path.join(tmpdir, f"{i}.svg")
+                with open(source, "wb") as f:
+                    f.write(svg)
+                actions += [f"file-open:{source}", "export-area-page", f"export-type:{type}",
+                            f"export-filename:{target}"]
+                if self.text_to_path:
+                    actions.append("export-text-to-path")
+                actions += ["export-do", "file-close"]
+
+            def convert(shell: InkscapeShell):
+                run_command_checked(shell, ";".join(actions))
+                missing = [target for (_, target) in batch if not os.path.isfile(target)]
+                if missing:
+                    raise Exception(f"Inkscape did not produce {missing}")
+
+            self.run_with_restart(index, convert)
+
+
+def run_command_checked(shell: InkscapeShell, command: str) -> str:
+    """Like `InkscapeShell.run_command`, but fails instead of hanging when Inkscape exits."""
+    shell.process.stdin.write(f"{command}\n")
+    shell.process.stdin.flush()
+    chars = []
+    while True:
+        character = shell.process.stdout.read(1)
+        if not character:
+            raise Exception("Inkscape exited unexpectedly")
+        if character == " " and chars and chars[-1] == ">" and (
+                len(chars) == 1 or chars[-2] == "\n"):
+            output = "".join(chars[:-2]).strip()
+            return output.splitlines()[-1] if output else output
+        chars.append(character)
+
+
+def make_backend(inkscape_bin: str, inkscape_factory: Callable[[], InkscapeShell],
+                 pool_size: int) -> Backend:
+    """
+    Returns an Inkscape backend with a pool of `pool_size` shells, or elsie's in-process Cairo
+    backend when `ELSIE_BACKEND=cairo` is set or `inkscape_bin` (the binary started by
+    `inkscape_factory`) is not available (e.g. on CI).
+    Cairo draws text through Pango and embeds the used glyphs, so it does not need
+    `text_to_path` to get stable output. Note that text metrics differ slightly between the
+    two backends.
+    """
+    cairo_requested = os.environ.get("ELSIE_BACKEND") == "cairo"
+    if cairo_requested or shutil.which(inkscape_bin) is None:
+        if not cairo_requested:
+            print(f"Warning: Inkscape binary '{inkscape_bin}' not found, rendering with Cairo "
+                  "(text metrics differ slightly)", file=sys.stderr)
+        from elsie.render.backends.cairo.backend import CairoBackend
+
+        return CairoBackend()
+    pool = InkscapePool(inkscape_factory, size=pool_size)
+    # InkscapeBackend only accepts an InkscapeShell, hand it the pool once it is constructed
+    backend = InkscapeBackend(pool.shell(0))
+    backend.inkscape = pool
+    return backend
+
+
+def slide_cache_key(slides: SlideDeck, svgs: List[str]) -> str:
+    """
+    The SVG of each step already contains the finished layout, the resolved styles and all
+    embedded images, so hashing it covers everything that can change the rendered slide.
+    """
+    hasher = hashlib.sha1(slides.backend.get_version(VERSION).encode())
+    for svg in svgs:
+        hasher.update(svg.encode())
+        hasher.update(b"\0")
+    return hasher.hexdigest()
+
+
+def render_slide_job(inkscape: InkscapeShell, job: SlideJob):
+    (path, steps) = job
+    merger = PyPdfMerger()
+    for (svg, step_path) in steps:
+        if not os.path.isfile(step_path):
+            export_by_inkscape(inkscape, svg.encode(), step_path, "pdf")
+        merger.append(step_path)
+    tmp_path = f"{path}.tmp"
+    merger.write(tmp_path, False)
+    os.replace(tmp_path, path)
+
+
+def init_worker(inkscape_factory: Callable[[], InkscapeShell]):
+    global WORKER_INKSCAPE
+    WORKER_INKSCAPE = inkscape_factory()
+
+
+def render_shard(shard: List[SlideJob]):
+    for job in shard:
+        render_slide_job(WORKER_INKSCAPE, job)
+
+
+def split_into_shards(jobs: List[SlideJob], count: int) -> List[List[SlideJob]]:
+    """Distributes the slides so that each shard gets roughly the same number of steps."""
+    shards = [[] for _ in range(count)]
+    loads = [0] * count
+    for job in sorted(jobs, key=lambda job: len(job[1]), reverse=True):
+        index = loads.index(min(loads))
+        shards[index].append(job)
+        loads[index] += len(job[1])
+    return [shard for shard in shards if shard]
+
+
+def render_slides(slides: SlideDeck, output: str = "slides.pdf",
+                  slide_postprocessing: Optional[Callable[[List[Box]], None]] = None,
+                  cache_dir: Optional[str] = None,
+                  workers: int = 1,
+                  inkscape_factory: Optional[Callable[[], InkscapeShell]] = None):
+    """
+    Renders the deck like `slides.render`, but keeps a merged PDF of each slide on disk.
+    Slides whose steps did not change are taken from the cache and skip Inkscape completely.
+
+    With `workers > 1` and more than one changed slide, the changed slides are split into
+    shards that are rendered in separate processes, each with its own Inkscape created by
+    `inkscape_factory`. The workers are forked, because the decks build the slides at import
+    time and a spawned worker would build the whole deck again. Otherwise the steps are
+    converted by the `InkscapePool` of the backend, if it has one.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(slides.fs_cache.cache_dir, "slides")
+    os.makedirs(cache_dir, exist_ok=True)
+
+    if slide_postprocessing:
+        slide_postprocessing([slide.box() for slide in slides._slides])
+
+    slides.backend.prune_cache()
+    slides.backend.save_cache()
+
+    fs_cache = slides.fs_cache
+    # Each slide is either a list of already exported PDFs or a path to its cached PDF
+    outputs = []
+    jobs: List[SlideJob] = []
+    used_files = set()
+    for slide in slides._slides:
+        slide.prepare()
+        units = [slide.make_render_unit(slides.backend, step, "pdf")
+                 for step in range(1, slide.steps() + 1)]
+        svgs = [unit.get_svg() for unit in units]
+
+        # External PDFs and non-SVG backends cannot be hashed, render them directly
+        if any(svg is None for svg in svgs):
+            outputs.append([unit.export(fs_cache, "pdf") for unit in units])
+            continue
+
+        filename = f"{slide_cache_key(slides, svgs)}.pdf"
+        path = os.path.join(cache_dir, filename)
+        outputs.append(path)
+        if filename in used_files:
+            continue
+        used_files.add(filename)
+
+        # Keep the per-step PDFs alive, so that a later edit of a single step
+        # does not have to re-render the whole slide
+        steps = []
+        for svg in svgs:
+            step_filename = fs_cache._get_filename(svg, "pdf")
+            fs_cache.touched_files.add(step_filename)
+            steps.append((svg, fs_cache._full_path(step_filename)))
+        if not os.path.isfile(path):
+            jobs.append((path, steps))
+
+    inkscape = getattr(slides.backend, "inkscape", None)
+    workers = min(workers, len(jobs))
+    if workers > 1:
+        assert inkscape_factory is not None
+        shards = split_into_shards(jobs, workers)
+        print(f"Rendering {len(jobs)} slides in {len(shards)} processes")
+        context = multiprocessing.get_context("fork")
+        with context.Pool(len(shards), initializer=init_worker,
+                          initargs=(inkscape_factory,)) as pool:
+            pool.map(render_shard, shards)
+    elif isinstance(inkscape, InkscapePool):
+        pending = {}
+        for (_, steps) in jobs:
+            for (svg, step_path) in steps:
+                if not os.path.isfile(step_path):
+                    pending[step_path] = svg.encode()
+        inkscape.convert_many([(svg, step_path) for (step_path, svg) in pending.items()])
+        for job in jobs:
+            render_slide_job(inkscape, job)
+    else:
+        for job in jobs:
+            render_slide_job(inkscape, job)
+
+    merger = PyPdfMerger()
+    for item in outputs:
+        for path in (item if isinstance(item, list) else [item]):
+            merger.append(path)
+    merger.write(output, False)
+
+    fs_cache.remove_unused()
+    for filename in os.listdir(cache_dir):
+        if filename not in used_files:
+            os.remove(os.path.join(cache_dir, filename))
+
+    print(f"Rendered {len(jobs)} changed slide(s) out of {len(slides._slides)}")
+    print(f"SlideDeck written into '{output}'")
@@ -2,15 +2,12 @@ import json
 import math
 import os
 import subprocess
-from pathlib import Path
 from typing import List, Optional
 
 import elsie
-from PIL import Image
 from elsie import SlideDeck, TextStyle
 from elsie.boxtree.box import Box
 from elsie.ext import unordered_list
-from elsie.render.backends import InkscapeBackend
 from elsie.render.inkscape import InkscapeShell
 from elsie.text.textstyle import TextStyle as T
 
@@ -20,15 +17,22 @@ from config import HEIGHT, REFERENCE_HEIGHT, REFERENCE_WIDTH, WIDTH, sh, sw
 from history import history
 from homu import homu
 from porting_process import porting_process
-from utils import COLOR_ORANGE, GITHUB_BG_COLOR, LOWER_OPACITY, generate_qr_code, iterate_grid
+from render import make_backend, render_slides
+from utils import COLOR_ORANGE, GITHUB_BG_COLOR, LOWER_OPACITY, avatar_mosaic, generate_qr_code
 
 PRODUCTION_BUILD = True
+RENDER_WORKERS = os.cpu_count()
+INKSCAPE_BIN = "/usr/bin/inkscape"
 
 BG_COLOR = "#FFA700"
 
-backend = InkscapeBackend(InkscapeShell("/usr/bin/inkscape", text_to_path=True))
+
+def inkscape_shell() -> InkscapeShell:
+    return InkscapeShell(INKSCAPE_BIN, text_to_path=True)
+
+
+backend = make_backend(INKSCAPE_BIN, inkscape_shell, pool_size=RENDER_WORKERS)
 slides = elsie.SlideDeck(name_policy="ignore", width=WIDTH, height=HEIGHT, backend=backend)
-# slides = elsie.SlideDeck(name_policy="ignore", backend=CairoBackend())
 
 slides.update_style("default",
                     TextStyle(font="Raleway", variant_numeric="lining-nums", size=60))
@@ -115,31 +119,12 @@ def rust_infra_team(slide: Box):
 
 
 def get_bors_contributors_image_path() -> str:
-    width = 90
-    height = 90
     rows = 9
     cols = 12
-    padding = 5
     images = sorted([f"contributors/avatars/{file}" for file in os.listdir("contributors/avatars")],
                     key=lambda v: v.lower())
     assert rows * cols == len(images)
-
-    def generate(path: Path):
-        img = Image.new("RGBA", ((width + padding) * cols, (height + padding) * rows), "WHITE")
-        white_bg = Image.new("RGBA", (width, height), "WHITE")
-        for (image, (row, col)) in zip(images,
-                                       iterate_grid(rows, cols, width, height, p_horizontal=padding,
-                                                    p_vertical=padding)):
-            avatar = Image.open(image).resize((width, height)).convert("RGBA")
-            avatar = Image.alpha_composite(white_bg, avatar)
-            img.paste(avatar, (col, row))
-        img.convert("RGBA").save(path)
-
-    key = Path(f"images/bors-contributors.png")
-    if not key.is_file():
-        generate(key)
-
-    return str(key)
+    return avatar_mosaic(images, rows=rows, cols=cols, width=90, height=90, padding=5)
 
 
 @slides.slide()
@@ -235,6 +220,6 @@ if PRODUCTION_BUILD:
     print_stats(slides, minutes=30)
 
 # if PRODUCTION_BUILD:
-#     slides.render("slides.pdf", slide_postprocessing=page_numbering)
+#     render_slides(slides, "slides.pdf", slide_postprocessing=page_numbering)
 # else:
-slides.render("slides.pdf")
+render_slides(slides, "slides.pdf", workers=RENDER_WORKERS, inkscape_factory=inkscape_shell)
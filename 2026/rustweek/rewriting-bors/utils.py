@@ -1,8 +1,13 @@
+import hashlib
 import io
+import json
+import os
+from pathlib import Path
 from typing import Callable, List, Optional, Tuple, Union
 
 import elsie
 from elsie import Arrow, Slides, TextStyle as T
+from elsie.boxtree import boxmixin
 from elsie.boxtree.box import Box
 from elsie.boxtree.boxitem import BoxItem
 from elsie.ext import unordered_list
@@ -77,10 +82,13 @@ def list_item(parent, level=0, bullet="•", bullet_style="default", **box_args)
     return b.box(width="fill")
 
 
+CODE_BG_COLOR = "#EEEEEE"
+
+
 def code(parent: Box, code: str, language="rust", width=None, code_style="code", p_right=50,
          return_box=False, **kwargs) -> Union[Box, TextBoxItem]:
     content = parent.box(width=width)
-    content.rect(bg_color="#EEEEEE")
+    content.rect(bg_color=CODE_BG_COLOR)
     codebox = content.box(p_left=10, p_right=p_right, p_y=10, z_level=100, x=0)
     innerbox = codebox.code(language, code, style=code_style, **kwargs)
     if return_box:
@@ -88,6 +96,37 @@ def code(parent: Box, code: str, language="rust", width=None, code_style="code",
     return codebox
 
 
+# Shared by all decks, identical snippets in different talks use the same entry
+HIGHLIGHT_CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "talks-highlight"
+
+
+def cached_highlight_code(code: str, language: str) -> List[Tuple]:
+    """
+    Replacement of elsie's `highlight_code` that stores the Pygments tokens on disk, keyed by
+    the language, the code and the Pygments/elsie versions.
+    """
+    import pygments
+    from elsie.text.highlight import highlight_code
+    from elsie.version import VERSION
+
+    hasher = hashlib.sha1(f"{pygments.__version__}/{VERSION}/{language}".encode())
+    hasher.update(code.encode())
+    path = HIGHLIGHT_CACHE_DIR / f"{hasher.hexdigest()}.json"
+    if path.is_file():
+        return [tuple(token) for token in json.loads(path.read_text())]
+
+    tokens = highlight_code(code, language)
+    HIGHLIGHT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(tokens))
+    tmp_path.replace(path)
+    return tokens
+
+
+# `Box.code` tokenizes snippets through this name
+boxmixin.highlight_code = cached_highlight_code
+
+
 def with_bg(parent: Box, bg_color="#DDDDDD") -> Box:
     quote = parent.box()
     quote.rect(bg_color=bg_color)
@@ -149,11 +188,73 @@ def last(n: int) -> List[int]:
     return [v * -1 for v in reversed(range(1, n + 1))]
 
 
+def resolve_line_step(lines: List[str], visible_lines) -> List[Union[int, str, None]]:
+    actual_lines = []
+    rest_skip = 0
+    for (index, item) in enumerate(visible_lines):
+        if item is ShowRest:
+            assert index == len(visible_lines) - 1
+            actual_lines += list(
+                range(index,
+                      index + ((len(lines) - len(actual_lines)) - rest_skip)))
+        elif item is HideRest:
+            assert index == len(visible_lines) - 1
+            actual_lines += [None] * ((len(lines) - len(actual_lines)) - rest_skip)
+        elif item is Skip:
+            rest_skip += 1
+            continue
+        else:
+            actual_lines.append(item)
+    return actual_lines
+
+
+def is_maskable_step(lines: List[str], actual_lines: List[Union[int, str, None]]) -> bool:
+    """
+    Returns True if the step only hides some lines of the snippet, without reordering or
+    replacing them.
+    """
+    if len(actual_lines) != len(lines):
+        return False
+    return all(visible is None or (isinstance(visible, int) and visible % len(lines) == index)
+               for (index, visible) in enumerate(actual_lines))
+
+
 def code_step(parent: Box, code_content: str, line_steps, show_start: int = 1, **code_args):
     show_start = int(show_start)
 
     code_content = code_content.strip()
     lines = code_content.split("\n")
+    steps = [resolve_line_step(lines, visible_lines) for visible_lines in line_steps]
+
+    def get_show(step: int) -> str:
+        show = str(step + show_start)
+        if step == len(steps) - 1:
+            show += "+"
+        return show
+
+    if all(is_maskable_step(lines, actual_lines) for actual_lines in steps):
+        # Highlight and lay out the snippet only once, hidden lines are covered by masks
+        return_codebox = code_args.pop("return_box", False)
+        codebox = code(parent.overlay(show=f"{show_start}+"), code_content, return_box=True,
+                       **code_args)
+        for (step, actual_lines) in enumerate(steps):
+            hidden = [visible is None for visible in actual_lines]
+            index = 0
+            while index < len(lines):
+                if not hidden[index]:
+                    index += 1
+                    continue
+                count = 1
+                while index + count < len(lines) and hidden[index + count]:
+                    count += 1
+                codebox.line_box(index, n_lines=count, show=get_show(step),
+                                 z_level=101).rect(bg_color=CODE_BG_COLOR)
+                index += count
+        # Keep the step count even when the last steps do not hide anything
+        parent.overlay(show=get_show(len(steps) - 1))
+        if return_codebox:
+            return codebox
+        return codebox._get_box()
 
     def get_line(lines, visible):
         if visible is None:
@@ -164,28 +265,8 @@ def code_step(parent: Box, code_content: str, line_steps, show_start: int = 1, *
             return visible
 
     last = None
-    for (step, visible_lines) in enumerate(line_steps):
-        actual_lines = []
-        rest_skip = 0
-        for (index, item) in enumerate(visible_lines):
-            if item is ShowRest:
-                assert index == len(visible_lines) - 1
-                actual_lines += list(
-                    range(index,
-                          index + ((len(lines) - len(actual_lines)) - rest_skip)))
-            elif item is HideRest:
-                assert index == len(visible_lines) - 1
-                actual_lines += [None] * ((len(lines) - len(actual_lines)) - rest_skip)
-            elif item is Skip:
-                rest_skip += 1
-                continue
-            else:
-                actual_lines.append(item)
-
-        show = str(step + show_start)
-        if step == len(line_steps) - 1:
-            show += "+"
-        wrapper = parent.overlay(show=show)
+    for (step, actual_lines) in enumerate(steps):
+        wrapper = parent.overlay(show=get_show(step))
 
         current_lines = [get_line(lines, visible) for visible in actual_lines]
         last = code(wrapper, "\n".join(current_lines), **code_args)
@@ -219,6 +300,79 @@ def iterate_grid(rows: int, cols: int, width: int, height: int, p_horizontal: in
         col = 0
 
 
+AVATAR_CACHE_DIR = Path("elsie-cache/avatars")
+
+
+def avatar_thumbnail(path: str, width: int, height: int):
+    """
+    Returns the avatar at `path` resized to `width`x`height` as an RGBA image.
+    Thumbnails are stored on disk keyed by the content hash of the avatar, so each original is
+    decoded only once per size.
+    """
+    from PIL import Image
+
+    digest = hashlib.sha1(Path(path).read_bytes()).hexdigest()
+    thumbnail_path = AVATAR_CACHE_DIR / f"{digest}-{width}x{height}.png"
+    if thumbnail_path.is_file():
+        return Image.open(thumbnail_path)
+
+    with Image.open(path) as image:
+        thumbnail = image.resize((width, height)).convert("RGBA")
+    AVATAR_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = thumbnail_path.with_suffix(".tmp")
+    thumbnail.save(tmp_path, format="PNG")
+    tmp_path.replace(thumbnail_path)
+    return thumbnail
+
+
+MOSAIC_CACHE_DIR = Path("elsie-cache/mosaics")
+
+
+def avatar_mosaic(images: List[str], rows: int, cols: int, width: int, height: int,
+                  padding: int) -> str:
+    """
+    Composes avatars (row by row) into a grid of `rows`x`cols` tiles separated by `padding`
+    white pixels and returns the path to the resulting PNG.
+    Each row of tiles is blended over white in a single NumPy pass and pasted into a
+    preallocated sheet, so besides the sheet itself only one band of rows is in memory.
+    The sheet is keyed by the grid geometry and the contents of all avatars, so adding or
+    changing an avatar creates a new sheet.
+    """
+    import numpy as np
+    from PIL import Image
+
+    assert len(images) <= rows * cols
+    hasher = hashlib.sha1(repr((rows, cols, width, height, padding)).encode())
+    for image in images:
+        hasher.update(hashlib.sha1(Path(image).read_bytes()).digest())
+    path = MOSAIC_CACHE_DIR / f"{hasher.hexdigest()}.png"
+    if path.is_file():
+        return str(path)
+
+    cell_height = height + padding
+    cell_width = width + padding
+    sheet = Image.new("RGB", (cols * cell_width, rows * cell_height), "white")
+    for row in range(rows):
+        row_images = images[row * cols:(row + 1) * cols]
+        if not row_images:
+            break
+        tiles = np.stack([np.asarray(avatar_thumbnail(image, width, height)) for image in row_images])
+        rgb = tiles[..., :3].astype(np.uint32)
+        alpha = tiles[..., 3:].astype(np.uint32)
+        blended = (rgb * alpha + 255 * (255 - alpha) + 127) // 255
+        band = np.full((height, len(row_images), cell_width, 3), 255, dtype=np.uint8)
+        # (tiles, height, width, 3) -> (height, tiles, width, 3)
+        band[:, :, :width] = blended.transpose(1, 0, 2, 3)
+        sheet.paste(Image.fromarray(band.reshape(height, len(row_images) * cell_width, 3)),
+                    (0, row * cell_height))
+
+    MOSAIC_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    sheet.save(tmp_path, format="PNG")
+    tmp_path.replace(path)
+    return str(path)
+
+
 def big_text_slide(slide: Box, text: str):
     slide.box().text(text, style=T(size=60, bold=True))
 